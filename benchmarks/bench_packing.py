@@ -0,0 +1,91 @@
+"bench_packing.py - compare frame buffer packing against the old per-pixel loop"
+# Copyright (c) 2018 Elad Alfassa <elad@fedoraproject.org>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# This benchmark doesn't need any hardware, run it from the repository root:
+#   python -m benchmarks.bench_packing
+
+from __future__ import print_function, division
+from rpi_epd2in7 import packing
+from PIL import Image
+from PIL import ImageDraw
+import random
+import timeit
+
+WIDTH = 176
+HEIGHT = 264
+
+
+def legacy_pack(image_monocolor, height, width):
+    """ The original per-pixel implementation, kept here for comparison """
+    buf = [0x00] * (width * height // 8)
+    pixels = image_monocolor.load()
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] != 0:
+                buf[(x + y * width) // 8] |= (0x80 >> (x % 8))
+    return buf
+
+
+def make_image():
+    random.seed(0)
+    image = Image.new('1', (WIDTH, HEIGHT), 255)
+    draw = ImageDraw.Draw(image)
+    for _ in range(40):
+        x, y = random.randrange(WIDTH), random.randrange(HEIGHT)
+        draw.rectangle((x, y, x + random.randrange(30), y + random.randrange(30)), fill=0)
+    return image
+
+
+def bench(name, func, number):
+    elapsed = min(timeit.repeat(func, number=number, repeat=3)) / number
+    print("{0:<24} {1:10.3f} ms".format(name, elapsed * 1000))
+    return elapsed
+
+
+def main():
+    image = make_image()
+    crop = image.crop((40, 100, 40 + 64, 100 + 20))
+    odd = image.crop((3, 3, 3 + 61, 3 + 20))
+
+    assert bytearray(legacy_pack(image, HEIGHT, WIDTH)) == packing.pack_image(image)
+    assert bytearray(legacy_pack(crop, 20, 64)) == packing.pack_image(crop)
+    assert packing._pack_python(odd) == packing.pack_image(odd)
+
+    print("full frame ({0}x{1}):".format(WIDTH, HEIGHT))
+    legacy = bench("  legacy loop", lambda: legacy_pack(image, HEIGHT, WIDTH), 3)
+    fast = bench("  pack_image", lambda: packing.pack_image(image), 200)
+    print("  speedup: {0:.0f}x".format(legacy / fast))
+
+    print("partial crop (64x20):")
+    legacy = bench("  legacy loop", lambda: legacy_pack(crop, 20, 64), 50)
+    fast = bench("  pack_image", lambda: packing.pack_image(crop), 2000)
+    print("  speedup: {0:.0f}x".format(legacy / fast))
+
+    print("unaligned crop (61x20):")
+    bench("  pure python", lambda: packing._pack_python(odd), 50)
+    if packing.numpy is not None:
+        bench("  numpy packbits", lambda: packing._pack_numpy(odd), 2000)
+    else:
+        print("  numpy is not installed, skipping")
+
+
+if __name__ == '__main__':
+    main()
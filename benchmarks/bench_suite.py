@@ -0,0 +1,256 @@
+"bench_suite.py - measure the library's hot paths and refresh workloads, as JSON"
+# Copyright (c) 2018 Elad Alfassa <elad@fedoraproject.org>
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# This benchmark runs against the simulated panel, so it doesn't need any hardware.
+# Run it from the repository root:
+#   python -m benchmarks.bench_suite > results.json
+# Wall clock times ("*_ms") depend on the machine, everything else
+# (bytes, transfers, simulated seconds) should be exactly reproducible.
+
+from __future__ import print_function, division
+from rpi_epd2in7 import packing
+from rpi_epd2in7.dither import Ditherer, MODES
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.regions import find_dirty_regions
+from rpi_epd2in7.simulator import SimulatedBackend
+from PIL import Image
+from PIL import ImageDraw
+import argparse
+import itertools
+import json
+import platform
+import random
+import sys
+import timeit
+
+WIDTH = 176
+HEIGHT = 264
+
+
+def timed(func, number, repeat=3):
+    """ Best time of `repeat` runs of `func`, in milliseconds per call """
+    return min(timeit.repeat(func, number=number, repeat=repeat)) / number * 1000
+
+
+def blank():
+    return Image.new('1', (WIDTH, HEIGHT), 255)
+
+
+def clock_tick(frames):
+    """ A clock in the corner of an otherwise static screen, ticking every second """
+    for second in range(frames):
+        image = blank()
+        draw = ImageDraw.Draw(image)
+        draw.rectangle((0, 0, WIDTH - 1, 30), outline=0)
+        draw.text((8, 200), "12:34:{0:02d}".format(second % 60), fill=0)
+        yield image
+
+
+def clock_and_counter(frames):
+    """ A clock in the top left corner and a counter in the bottom right one,
+    both changing every frame, with nothing changing in between """
+    for second in range(frames):
+        image = blank()
+        draw = ImageDraw.Draw(image)
+        draw.text((2, 2), "12:34:{0:02d}".format(second % 60), fill=0)
+        draw.text((WIDTH - 40, HEIGHT - 14), "{0:05d}".format(second * 7), fill=0)
+        yield image
+
+
+def scrolling_text(frames):
+    """ A full screen of text lines, scrolling up by one line every frame """
+    lines = ["line {0}: the quick brown fox".format(i) for i in range(frames + 30)]
+    for frame in range(frames):
+        image = blank()
+        draw = ImageDraw.Draw(image)
+        for row, line in enumerate(lines[frame:frame + 26]):
+            draw.text((2, row * 10), line, fill=0)
+        yield image
+
+
+def full_redraw(frames):
+    """ Completely different content every frame """
+    rng = random.Random(0)
+    for _ in range(frames):
+        image = blank()
+        draw = ImageDraw.Draw(image)
+        for _ in range(40):
+            x, y = rng.randrange(WIDTH), rng.randrange(HEIGHT)
+            draw.rectangle((x, y, x + rng.randrange(40), y + rng.randrange(40)), fill=0)
+        yield image
+
+
+WORKLOADS = {
+    'clock_tick': clock_tick,
+    'clock_and_counter': clock_and_counter,
+    'scrolling_text': scrolling_text,
+    'full_redraw': full_redraw,
+}
+
+
+def new_epd():
+    panel = SimulatedBackend()
+    epd = EPD(backend=panel)
+    epd.init()
+    return epd, panel
+
+
+def run_updates(method, images):
+    """ Feed `images` to `method` of a fresh simulated EPD, after an initial full refresh.
+    Returns the per-update averages """
+    epd, panel = new_epd()
+    epd.display_frame(images[0])
+    panel.reset_stats()
+    start = panel.now()
+    wall = timeit.default_timer()
+    for image in images[1:]:
+        method(epd, image)
+    wall = timeit.default_timer() - wall
+    stats = panel.stats()
+    count = len(images) - 1
+    return {
+        'updates': count,
+        'wall_ms': wall / count * 1000,
+        'simulated_s': (stats['time'] - start) / count,
+        'bytes': stats['bytes_sent'] / count,
+        'transfers': stats['transfers'] / count,
+        'commands': stats['commands'] / count,
+        'full_refreshes': stats['full_refreshes'],
+        'partial_refreshes': stats['partial_refreshes'],
+        'fast_refreshes': sum(1 for r in panel.refreshes if r.lut == 'quick'),
+        # Pixels driven through a waveform, changed or not
+        'refreshed_pixels': sum((r.region[2] - r.region[0]) * (r.region[3] - r.region[1])
+                                for r in panel.refreshes) / count,
+    }
+
+
+def bench_workload(name, frames):
+    images = list(WORKLOADS[name](frames))
+    # The area display_partial_frame() is asked to refresh is the bounding box
+    # of everything that changes in the workload, like an application would do
+    bbox = None
+    for previous, image in zip(images, images[1:]):
+        diff = packing.xor_buffers(packing.pack_image(previous), packing.pack_image(image))
+        for x0, y0, x1, y1 in find_dirty_regions(diff, WIDTH, HEIGHT, max_regions=1):
+            bbox = (x0, y0, x1, y1) if bbox is None else (
+                min(bbox[0], x0), min(bbox[1], y0), max(bbox[2], x1), max(bbox[3], y1))
+    if bbox is None:
+        bbox = (0, 0, WIDTH, HEIGHT)
+    x0, y0, x1, y1 = bbox
+
+    return {
+        'frames': frames,
+        'partial_region': list(bbox),
+        'smart_update': run_updates(lambda epd, image: epd.smart_update(image), images),
+        'display_frame': run_updates(lambda epd, image: epd.display_frame(image), images),
+        'display_partial_frame': run_updates(
+            lambda epd, image: epd.display_partial_frame(image, x0, y0, y1 - y0, x1 - x0), images),
+        'display_partial_frame_fast': run_updates(
+            lambda epd, image: epd.display_partial_frame(image, x0, y0, y1 - y0, x1 - x0, fast=True),
+            images),
+    }
+
+
+def bench_micro(scale):
+    epd, panel = new_epd()
+    images = list(full_redraw(2))
+    image = images[0].convert('1')
+    crop = image.crop((40, 100, 40 + 64, 100 + 20))
+    old = packing.pack_image(images[0])
+    new = packing.pack_image(images[1])
+    clock = [packing.pack_image(image) for image in clock_tick(2)]
+    corners = [packing.pack_image(image) for image in clock_and_counter(2)]
+
+    panel.reset_stats()
+    epd.set_lut(force=True)
+    lut_stats = panel.stats()
+
+    # A grayscale photo-like image, and the same one with a small change
+    photo = Image.radial_gradient('L').resize((WIDTH, HEIGHT))
+    changed = photo.copy()
+    ImageDraw.Draw(changed).rectangle((40, 100, 80, 110), fill=0)
+    photos = [photo, changed]
+
+    results = {
+        'frame_buffer_full_ms': timed(
+            lambda: epd._get_frame_buffer_for_size(image, HEIGHT, WIDTH), 200 * scale),
+        'frame_buffer_crop_ms': timed(
+            lambda: epd._get_frame_buffer_for_size(crop, 20, 64), 2000 * scale),
+        'xor_buffers_ms': timed(lambda: packing.xor_buffers(old, new), 2000 * scale),
+        # What smart_update() does to decide which regions to refresh
+        'changed_regions_scattered_ms': timed(
+            lambda: epd._changed_regions(old, new), 20 * scale),
+        'changed_regions_clock_ms': timed(
+            lambda: epd._changed_regions(clock[0], clock[1]), 200 * scale),
+        'changed_regions_corners_ms': timed(
+            lambda: epd._changed_regions(corners[0], corners[1]), 200 * scale),
+        'set_lut_ms': timed(lambda: epd.set_lut(force=True), 200 * scale),
+        'set_lut_bytes': lut_stats['bytes_sent'],
+        'set_lut_transfers': lut_stats['transfers'],
+        'convert_pillow_ms': timed(lambda: photo.convert('1'), 200 * scale),
+    }
+    for mode in MODES:
+        # Without the cache, then alternating between two images (only a few
+        # rows differ), then the same image over and over
+        results['dither_{0}_ms'.format(mode)] = timed(
+            lambda: Ditherer(mode).convert(photo), 200 * scale)
+        ditherer = Ditherer(mode)
+        alternating = itertools.cycle(photos)
+        results['dither_{0}_changed_ms'.format(mode)] = timed(
+            lambda: ditherer.convert(next(alternating)), 200 * scale)
+        results['dither_{0}_same_ms'.format(mode)] = timed(
+            lambda: ditherer.convert(photo), 200 * scale)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--frames', type=int, default=20,
+                        help='number of frames in every workload')
+    parser.add_argument('--scale', type=int, default=1,
+                        help='multiply the number of iterations of micro benchmarks')
+    parser.add_argument('--workload', action='append', choices=sorted(WORKLOADS),
+                        help='only run this workload (can be given more than once)')
+    parser.add_argument('--output', help='write the results to this file instead of stdout')
+    args = parser.parse_args()
+
+    results = {
+        'environment': {
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'numpy': packing.numpy is not None,
+        },
+        'micro': bench_micro(args.scale),
+        'workloads': dict((name, bench_workload(name, args.frames))
+                          for name in (args.workload or sorted(WORKLOADS))),
+    }
+    output = json.dumps(results, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            output_file.write(output + '\n')
+    else:
+        print(output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
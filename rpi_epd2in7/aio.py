@@ -0,0 +1,160 @@
+""" aio.py - asyncio support for the e-paper display """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+# This module requires Python 3.5 or newer.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from .epd import EPD, BusyTimeoutError, GET_STATUS
+from .metrics import clock
+
+
+async def wait_until_idle(epd, timeout=None):
+    """ Wait until the display is idle without blocking the event loop.
+    This is the coroutine version of EPD.wait_until_idle() """
+    metrics = epd.metrics
+    if metrics is None:
+        return await _wait_until_idle(epd, timeout)
+    start = clock()
+    try:
+        await _wait_until_idle(epd, timeout)
+    finally:
+        metrics.record('busy_wait', clock() - start)
+
+
+async def _wait_until_idle(epd, timeout):
+    if timeout is None:
+        timeout = epd.busy_timeout
+    if epd.busy_status_workaround:
+        return await _poll_until_idle(epd, timeout)
+
+    loop = asyncio.get_event_loop()
+    idle = asyncio.Event()
+    # See EPD._wait_until_idle()
+    epd.send_command(GET_STATUS)
+    # The edge detection callback runs in a thread owned by RPi.GPIO
+    epd._watch_busy_pin(lambda: loop.call_soon_threadsafe(idle.set))
+    try:
+        if epd.is_busy():
+            try:
+                await asyncio.wait_for(idle.wait(), timeout)
+            except asyncio.TimeoutError:
+                epd.send_command(GET_STATUS)
+                if epd.is_busy():
+                    raise BusyTimeoutError('Display still busy after {0} seconds'.format(timeout))
+                epd._busy_fallback(timeout)
+    finally:
+        epd._unwatch_busy_pin()
+
+
+async def _poll_until_idle(epd, timeout):
+    """ Coroutine version of EPD._poll_until_idle() """
+    loop = asyncio.get_event_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    epd.send_command(GET_STATUS)
+    while epd.is_busy():
+        if deadline is not None and loop.time() > deadline:
+            raise BusyTimeoutError('Display still busy after {0} seconds'.format(timeout))
+        epd.send_command(GET_STATUS)
+        await asyncio.sleep(0.05)
+
+
+class AsyncEPD(object):
+    """ asyncio front-end for EPD.
+
+    Every display method is a coroutine. Image conversion and packing runs in
+    the event loop's default executor, while everything that talks to the
+    hardware (including waiting for the display to become idle) runs in a
+    single worker thread, so operations are serialized and the event loop is
+    never blocked. Operations reach the display in the order they were called,
+    even if preparing a later frame finishes first.
+
+    Don't modify an image until the coroutine it was passed to has finished. """
+
+    def __init__(self, epd=None, **kwargs):
+        """ Wrap `epd`, or create a new EPD object using `kwargs` if it's None """
+        self.epd = epd if epd is not None else EPD(**kwargs)
+        """ The wrapped EPD object. Don't call it directly while AsyncEPD is in use """
+        self._hardware = ThreadPoolExecutor(max_workers=1)
+        self._preparation = ThreadPoolExecutor(max_workers=4)
+
+    @property
+    def width(self):
+        """ Display width, in pixels """
+        return self.epd.width
+
+    @property
+    def height(self):
+        """ Display height, in pixels """
+        return self.epd.height
+
+    def _prepare(self, func, *args):
+        """ Start CPU-bound preparation work outside of the event loop.
+        Returns a concurrent.futures.Future """
+        return self._preparation.submit(func, *args)
+
+    async def _run_hardware(self, func, *args):
+        """ Run a hardware operation in the hardware worker thread.
+        The operation is queued right away, before this awaits anything """
+        return await asyncio.get_event_loop().run_in_executor(self._hardware, func, *args)
+
+    async def _run_prepared(self, func, prepared, *args):
+        """ Run `func` in the hardware worker thread with the result of the `prepared`
+        future, keeping its place in the queue while preparation is still running """
+        return await self._run_hardware(lambda: func(prepared.result(), *args))
+
+    async def init(self):
+        """ Coroutine version of EPD.init() """
+        await self._run_hardware(self.epd.init)
+
+    async def display_frame(self, image):
+        """ Coroutine version of EPD.display_frame() """
+        frame_buffer = self._prepare(self.epd._get_frame_buffer, image)
+        await self._run_prepared(self.epd._display_frame_buffer, frame_buffer)
+
+    async def display_partial_frame(self, image, x, y, h, w, fast=False):
+        """ Coroutine version of EPD.display_partial_frame() """
+        region = self.epd._get_partial_region(x, y, h, w)
+        new_fb = self._prepare(self.epd._get_partial_buffer, image, region)
+        await self._run_prepared(self.epd._display_partial_buffer, new_fb, region, fast)
+
+    async def smart_update(self, image):
+        """ Coroutine version of EPD.smart_update() """
+        frame_buffer = self._prepare(self.epd._get_frame_buffer, image)
+        await self._run_prepared(self.epd._smart_update_buffer, frame_buffer)
+
+    async def display_buffer(self, data, box=None):
+        """ Coroutine version of EPD.display_buffer() """
+        await self._run_hardware(self.epd.display_buffer, data, box)
+
+    async def smart_update_buffer(self, data, box=None):
+        """ Coroutine version of EPD.smart_update_buffer() """
+        await self._run_hardware(self.epd.smart_update_buffer, data, box)
+
+    async def sleep(self):
+        """ Coroutine version of EPD.sleep() """
+        await self._run_hardware(self.epd.sleep)
+
+    def close(self):
+        """ Stop the worker threads, after pending operations are done """
+        self._hardware.shutdown(wait=True)
+        self._preparation.shutdown(wait=True)
@@ -0,0 +1,155 @@
+""" backend.py - access to the SPI bus and GPIO pins the display is connected to """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import time
+
+from .metrics import clock
+
+# A backend is everything EPD needs from the outside world: an SPI bus to
+# write to, a few GPIO pins, and a way to wait. HardwareBackend talks to the
+# real thing, simulator.SimulatedBackend pretends to be a panel, so the rest
+# of the library can run on machines without a display attached.
+
+LOW = 0
+HIGH = 1
+
+
+# Default size of the spidev transfer buffer, used when it can't be read
+# from the kernel module parameters. Transfers bigger than this fail.
+SPI_DEFAULT_BUFSIZ = 4096
+
+
+def _get_spi_bufsiz():
+    """ Get the maximum transfer size supported by the spidev kernel module """
+    try:
+        with open('/sys/module/spidev/parameters/bufsiz') as bufsiz_file:
+            return int(bufsiz_file.read())
+    except (IOError, OSError, ValueError):
+        return SPI_DEFAULT_BUFSIZ
+
+
+class Backend(object):
+    """ Base class for the SPI and GPIO backends EPD uses.
+    Pins are identified by their BCM numbers """
+
+    max_transfer_size = SPI_DEFAULT_BUFSIZ
+    """ largest number of bytes spi_write() accepts at once """
+
+    def setup(self, outputs, inputs, spi_speed_hz, spi_mode=0):
+        """ Configure `outputs` and `inputs` pins and the SPI bus """
+        raise NotImplementedError()
+
+    def set_spi_speed(self, spi_speed_hz):
+        """ Change the SPI clock speed after setup() """
+        raise NotImplementedError()
+
+    def write_pin(self, pin, value):
+        raise NotImplementedError()
+
+    def read_pin(self, pin):
+        raise NotImplementedError()
+
+    def spi_write(self, data):
+        """ Write a buffer of at most `max_transfer_size` bytes to the SPI bus """
+        raise NotImplementedError()
+
+    def spi_read(self, count):
+        """ Read `count` bytes from the SPI bus """
+        raise NotImplementedError()
+
+    def watch_rising(self, pin, callback):
+        """ Call `callback` (possibly from another thread) when `pin` goes high """
+        raise NotImplementedError()
+
+    def unwatch(self, pin):
+        """ Stop calling the callback passed to watch_rising() """
+        raise NotImplementedError()
+
+    def sleep(self, seconds):
+        time.sleep(seconds)
+
+    def now(self):
+        """ Current time in seconds, for measuring how long things take """
+        return clock()
+
+
+class HardwareBackend(Backend):
+    """ Backend for a display connected to the Raspberry Pi, using spidev and RPi.GPIO """
+
+    def __init__(self, bus=0, device=0):
+        self.bus = bus
+        self.device = device
+        self.gpio = None
+        self.spi = None
+        self.max_transfer_size = _get_spi_bufsiz()
+        self._writebytes2 = None
+
+    def setup(self, outputs, inputs, spi_speed_hz, spi_mode=0):
+        if self.spi is None:
+            # Opened here, rather than when the backend is created, so creating an
+            # EPD object is cheap. Imported here so the rest of the library can be
+            # used without these modules
+            import spidev
+            import RPi.GPIO
+            self.gpio = RPi.GPIO
+            self.spi = spidev.SpiDev(self.bus, self.device)
+            # writebytes2 (spidev >= 3.4) accepts buffers directly, older versions need a list
+            self._writebytes2 = getattr(self.spi, 'writebytes2', None)
+        GPIO = self.gpio
+        GPIO.setmode(GPIO.BCM)
+        GPIO.setwarnings(False)
+        for pin in outputs:
+            GPIO.setup(pin, GPIO.OUT)
+        for pin in inputs:
+            GPIO.setup(pin, GPIO.IN)
+        self.spi.max_speed_hz = spi_speed_hz
+        self.spi.mode = spi_mode
+
+    def set_spi_speed(self, spi_speed_hz):
+        self.spi.max_speed_hz = spi_speed_hz
+
+    def write_pin(self, pin, value):
+        return self.gpio.output(pin, value)
+
+    def read_pin(self, pin):
+        return self.gpio.input(pin)
+
+    def spi_write(self, data):
+        if self._writebytes2 is not None:
+            self._writebytes2(data)
+        else:
+            self.spi.writebytes(list(bytearray(data)))
+
+    def spi_read(self, count):
+        # The display has no MISO line, it answers on the data line.
+        # This needs the SPI driver to support 3-wire mode
+        self.spi.threewire = True
+        try:
+            return bytearray(self.spi.readbytes(count))
+        finally:
+            self.spi.threewire = False
+
+    def watch_rising(self, pin, callback):
+        self.gpio.add_event_detect(pin, self.gpio.RISING, callback=lambda channel: callback())
+
+    def unwatch(self, pin):
+        self.gpio.remove_event_detect(pin)
@@ -0,0 +1,180 @@
+""" calibration.py - find the fastest SPI settings that work with a display """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import collections
+import json
+import platform
+
+from .epd import DATA_START_TRANSMISSION_1
+
+# The controller can't be asked what it received, but it can be asked for its
+# temperature. Reading the sensor sends a command and reads the answer at the
+# current clock speed, so if a frame's worth of test patterns followed by a
+# sensor read keeps giving the same temperature, the wiring carries that speed.
+# The patterns go to the "old data" frame RAM, which is sent again before every
+# refresh, so probing doesn't change what the display shows.
+
+SPEEDS = (2000000, 4000000, 8000000, 10000000, 16000000, 20000000, 32000000)
+""" SPI clock speeds probe() tries, in Hz """
+
+CHUNK_SIZES = (256, 512, 1024, 2048, 4096, 8192, 16384, 65536)
+""" SPI transfer sizes probe() tries, in bytes. Sizes the backend doesn't support are skipped """
+
+TEMPERATURE_TOLERANCE = 1.0
+""" Degrees Celsius a reading can be away from the first one, and still be right """
+
+Profile = collections.namedtuple('Profile', ['device', 'spi_speed_hz', 'spi_chunk_size', 'throughput'])
+""" SPI settings found by probe(), for the `device` they were found on.
+`throughput` is in bytes per second of frame data """
+
+
+class CalibrationError(RuntimeError):
+    """ Raised when the SPI settings can't be probed """
+
+
+def device_id(backend=None):
+    """ Identify the board (and SPI device) the display is connected to """
+    board = None
+    for path in ('/proc/device-tree/serial-number', '/etc/machine-id'):
+        try:
+            with open(path, 'rb') as id_file:
+                board = id_file.read().strip(b'\x00\n ').decode('ascii', 'replace')
+        except (IOError, OSError):
+            continue
+        if board:
+            break
+    board = board or platform.node()
+    if hasattr(backend, 'bus') and hasattr(backend, 'device'):
+        return '{0}:spi{1}.{2}'.format(board, backend.bus, backend.device)
+    return board
+
+
+def _test_pattern(size):
+    """ Alternating bits, then all bits flipped at once, the hardest for a bad line """
+    pattern = bytearray(b'\x55\xaa\x00\xff' * (size // 4 + 1))
+    return pattern[:size]
+
+
+def _verify(epd, pattern, reference, rounds):
+    """ Check that transfers at the current speed arrive intact """
+    for _ in range(rounds):
+        epd.send_command(DATA_START_TRANSMISSION_1)
+        epd.send_data_bulk(pattern)
+        temperature = epd.read_temperature()
+        if temperature is None or abs(temperature - reference) > TEMPERATURE_TOLERANCE:
+            return False
+    return True
+
+
+def _throughput(epd, pattern, rounds):
+    """ Best bytes per second of sending `pattern`, in `rounds` tries """
+    backend = epd.backend
+    best = 0
+    for _ in range(rounds):
+        start = backend.now()
+        epd.send_command(DATA_START_TRANSMISSION_1)
+        epd.send_data_bulk(pattern)
+        elapsed = backend.now() - start
+        if elapsed > 0:
+            best = max(best, len(pattern) / elapsed)
+    return best
+
+
+def probe(epd, speeds=SPEEDS, chunk_sizes=CHUNK_SIZES, rounds=3):
+    """ Find the fastest SPI clock speed that works, and the best transfer size at that speed.
+    Speeds are tried from the slowest up, until one fails. Doesn't change `epd`'s settings,
+    see apply_profile(). Takes a few seconds, and re-initializes the display at the end.
+
+    Raises CalibrationError if the temperature sensor can't be read, which means
+    transfers can't be verified (see EPD.read_temperature()) """
+    if not epd._init_performed:
+        epd.init()
+    backend = epd.backend
+    pattern = _test_pattern(epd.panel_width * epd.panel_height // 8)
+    original_chunk_size = epd.spi_chunk_size
+    reference = epd.read_temperature()
+    if reference is None:
+        raise CalibrationError("Can't read the temperature sensor to verify transfers")
+    best_speed = None
+    try:
+        for speed in sorted(speeds):
+            backend.set_spi_speed(speed)
+            if not _verify(epd, pattern, reference, rounds):
+                break
+            best_speed = speed
+        if best_speed is None:
+            raise CalibrationError('None of the SPI speeds worked')
+        backend.set_spi_speed(best_speed)
+        best_chunk_size, best_throughput = None, 0
+        for chunk_size in sorted(chunk_sizes):
+            if chunk_size > backend.max_transfer_size:
+                break
+            epd.spi_chunk_size = chunk_size
+            throughput = _throughput(epd, pattern, rounds)
+            # Bigger transfers only win if they're actually faster
+            if throughput > best_throughput * 1.01:
+                best_chunk_size, best_throughput = chunk_size, throughput
+    finally:
+        epd.spi_chunk_size = original_chunk_size
+        backend.set_spi_speed(epd.spi_speed_hz)
+        # A garbled transfer could have left the controller in any state
+        epd.init()
+    return Profile(device_id(backend), best_speed, best_chunk_size, best_throughput)
+
+
+def apply_profile(epd, profile):
+    """ Use the SPI settings of `profile` for `epd` """
+    epd.spi_speed_hz = profile.spi_speed_hz
+    epd.spi_chunk_size = profile.spi_chunk_size
+    if epd._interface_ready:
+        epd.backend.set_spi_speed(profile.spi_speed_hz)
+
+
+def save_profile(path, profile):
+    """ Save `profile` as JSON """
+    with open(path, 'w') as profile_file:
+        json.dump(profile._asdict(), profile_file, indent=2, sort_keys=True)
+
+
+def load_profile(path, device=None):
+    """ Load a profile saved with save_profile().
+    Returns None if there isn't one, or it was found on a different `device` """
+    try:
+        with open(path) as profile_file:
+            profile = Profile(**json.load(profile_file))
+    except (IOError, OSError, ValueError, TypeError):
+        return None
+    if device is not None and profile.device != device:
+        return None
+    return profile
+
+
+def calibrate(epd, path, **kwargs):
+    """ Use the SPI settings saved in `path` for this device, probing and saving them first
+    if there aren't any. `kwargs` are passed to probe(). Returns the Profile used """
+    device = device_id(epd.backend)
+    profile = load_profile(path, device)
+    if profile is None:
+        profile = probe(epd, **kwargs)
+        save_profile(path, profile)
+    apply_profile(epd, profile)
+    return profile
@@ -0,0 +1,156 @@
+""" canvas.py - draw on the display, refreshing only what was drawn """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+from PIL import Image
+from PIL import ImageDraw
+
+from .packing import xor_buffers, crop_buffer, paste_buffer, rotate_buffer
+from .regions import merge_regions, find_dirty_regions
+
+
+def _points_box(xy):
+    """ Bounding box of a sequence of coordinates, in any of the forms ImageDraw accepts.
+    Coordinates are inclusive, like in ImageDraw, the box isn't """
+    if hasattr(xy[0], '__len__'):
+        xs = [point[0] for point in xy]
+        ys = [point[1] for point in xy]
+    else:
+        xs = xy[0::2]
+        ys = xy[1::2]
+    return (min(xs), min(ys), max(xs) + 1, max(ys) + 1)
+
+
+def _grow(box, pixels):
+    x0, y0, x1, y1 = box
+    return (x0 - pixels, y0 - pixels, x1 + pixels, y1 + pixels)
+
+
+class Canvas(object):
+    """ A drawing surface for the whole display, that remembers where it was drawn on.
+
+    The drawing methods are the same as PIL's ImageDraw ones. update() refreshes
+    only the areas that were drawn on since the last update, without comparing
+    the entire frame to what's on the display. Coordinates follow the EPD's rotation.
+
+    Usage:
+        canvas = Canvas(epd)
+        canvas.text((10, 10), "Hello", font=font, fill=0)
+        canvas.update()
+    """
+
+    def __init__(self, epd):
+        self.epd = epd
+        """ The EPD object the canvas is displayed on """
+        if epd._shadow is not None:
+            # Start from what the display shows
+            frame = rotate_buffer(epd._shadow, epd.panel_width, epd.panel_height,
+                                  (360 - epd.rotation) % 360)
+            self.image = Image.frombytes('1', (epd.width, epd.height), bytes(frame))
+        else:
+            self.image = Image.new('1', (epd.width, epd.height), 255)
+        """ mode '1' PIL Image of the canvas. Call mark_dirty() after drawing on it directly """
+        self.draw = ImageDraw.Draw(self.image)
+        self._dirty = []  # panel regions
+
+    def mark_dirty(self, box):
+        """ Refresh the (x0, y0, x1, y1) `box` on the next update() """
+        region = self.epd._panel_region(box)
+        if region is not None:
+            self._dirty.append(region)
+
+    def text(self, xy, text, fill=None, font=None, **kwargs):
+        if hasattr(self.draw, 'textbbox'):
+            box_kwargs = dict(kwargs)
+            box_kwargs.pop('stroke_fill', None)
+            box = self.draw.textbbox(xy, text, font=font, **box_kwargs)
+        else:
+            # Pillow < 8
+            width, height = self.draw.textsize(text, font=font)
+            box = (xy[0], xy[1], xy[0] + width, xy[1] + height)
+        self.draw.text(xy, text, fill=fill, font=font, **kwargs)
+        self.mark_dirty(_grow(box, 1))
+
+    def line(self, xy, fill=None, width=1, **kwargs):
+        self.draw.line(xy, fill=fill, width=width, **kwargs)
+        self.mark_dirty(_grow(_points_box(xy), width // 2 + 1))
+
+    def rectangle(self, xy, fill=None, outline=None, **kwargs):
+        self.draw.rectangle(xy, fill=fill, outline=outline, **kwargs)
+        self.mark_dirty(_points_box(xy))
+
+    def ellipse(self, xy, fill=None, outline=None, **kwargs):
+        self.draw.ellipse(xy, fill=fill, outline=outline, **kwargs)
+        self.mark_dirty(_points_box(xy))
+
+    def polygon(self, xy, fill=None, outline=None, **kwargs):
+        self.draw.polygon(xy, fill=fill, outline=outline, **kwargs)
+        self.mark_dirty(_points_box(xy))
+
+    def point(self, xy, fill=None):
+        self.draw.point(xy, fill=fill)
+        self.mark_dirty(_points_box(xy))
+
+    def paste(self, image, xy, mask=None):
+        """ Paste `image` with its top left corner at `xy` """
+        if image.mode != '1':
+            image = image.convert('1')
+        self.image.paste(image, (xy[0], xy[1]), mask)
+        self.mark_dirty((xy[0], xy[1], xy[0] + image.width, xy[1] + image.height))
+
+    def clear(self, box=None, fill=255):
+        """ Fill `box` (the whole canvas if None) with `fill` """
+        if box is None:
+            box = (0, 0, self.epd.width, self.epd.height)
+        x0, y0, x1, y1 = box
+        self.draw.rectangle((x0, y0, x1 - 1, y1 - 1), fill=fill)
+        self.mark_dirty(box)
+
+    def update(self):
+        """ Show what was drawn since the last update on the display,
+        deciding how to refresh it like EPD.smart_update() does """
+        epd = self.epd
+        dirty, self._dirty = self._dirty, []
+        if epd._needs_full_refresh():
+            epd._display_frame_buffer(epd._get_frame_buffer(self.image))
+            return
+        if not dirty:
+            return
+        refreshed = False
+        for region in merge_regions(dirty, epd._region_overhead(epd.fast_refresh), epd.max_partial_regions):
+            new_fb = epd._get_partial_buffer(self.image, region)
+            old_fb = crop_buffer(epd._shadow, epd.panel_width, region)
+            x0, y0, x1, y1 = region
+            # Drawing over something with the same thing doesn't change anything,
+            # only refresh the part that actually changed
+            changed = find_dirty_regions(xor_buffers(old_fb, new_fb), x1 - x0, y1 - y0, max_regions=1)
+            if not changed:
+                continue
+            cx0, cy0, cx1, cy1 = changed[0]
+            changed = (x0 + cx0, y0 + cy0, x0 + cx1, y0 + cy1)
+            if changed != region:
+                new_fb = crop_buffer(new_fb, x1 - x0, (cx0, cy0, cx1, cy1))
+                old_fb = crop_buffer(old_fb, x1 - x0, (cx0, cy0, cx1, cy1))
+            epd._smart_update_region(changed, old_fb, new_fb)
+            paste_buffer(epd._shadow, epd.panel_width, changed, new_fb)
+            refreshed = True
+        if refreshed:
+            epd._save_state()
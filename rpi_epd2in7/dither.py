@@ -0,0 +1,209 @@
+""" dither.py - turn grayscale and color images into black and white ones """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import threading
+
+from PIL import Image
+from PIL import ImageChops
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Pillow's image.convert('1') does Floyd-Steinberg error diffusion, which looks
+# best for photos, but the error spreads: changing a few pixels of the source
+# can change pixels all the way to the bottom right corner of the image, and
+# all of them have to be refreshed. Threshold and ordered dithering decide
+# every pixel on its own, so only what changed in the source changes on the
+# display, and only the rows that changed have to be converted again.
+
+THRESHOLD = 'threshold'
+""" Black below a fixed gray level, white above it. Best for text and line art """
+
+ORDERED = 'ordered'
+""" Ordered dithering with a Bayer matrix. Shows shades of gray with a regular pattern """
+
+DIFFUSION = 'diffusion'
+""" Floyd-Steinberg error diffusion, what Pillow does by default """
+
+MODES = (THRESHOLD, ORDERED, DIFFUSION)
+
+
+def bayer_matrix(size):
+    """ Get the `size`x`size` Bayer matrix (`size` is a power of 2), as a list of rows
+    with every number from 0 to size * size - 1 """
+    if size < 1 or size & (size - 1):
+        raise ValueError('Matrix size must be a power of 2, got {0}'.format(size))
+    matrix = [[0]]
+    while len(matrix) < size:
+        matrix = ([[4 * v for v in row] + [4 * v + 2 for v in row] for row in matrix] +
+                  [[4 * v + 3 for v in row] + [4 * v + 1 for v in row] for row in matrix])
+    return matrix
+
+
+def _thresholds(size):
+    """ Gray levels a pixel must be above to be white, for every cell of the Bayer matrix.
+    Spread evenly in 0-254, so black stays black and white stays white """
+    return [[(2 * v + 1) * 255 // (2 * size * size) for v in row] for row in bayer_matrix(size)]
+
+
+class Ditherer(object):
+    """ Converts images of any mode to mode '1', remembering the last image it converted.
+
+    Converting the same image again is free, and with THRESHOLD and ORDERED
+    only the rows that changed since the last image are converted again.
+    Needs numpy for that, without it only identical images are reused.
+
+    Usage:
+        epd.dither = Ditherer(ORDERED)
+        epd.smart_update(photo)
+    """
+
+    def __init__(self, mode=ORDERED, threshold=128, matrix_size=8):
+        """ `mode` - THRESHOLD, ORDERED or DIFFUSION
+        `threshold` - gray level (0-255) from which pixels are white, for THRESHOLD
+        `matrix_size` - size of the Bayer matrix for ORDERED, 2, 4, 8 or 16 """
+        if mode not in MODES:
+            raise ValueError('mode must be one of {0}, got {1}'.format(MODES, mode))
+        self.mode = mode
+        self.threshold = threshold
+        self.matrix_size = matrix_size
+        _thresholds(matrix_size)  # validate it
+        self.hits = 0
+        """ number of images that were the same as the last one """
+        self.misses = 0
+        """ number of images that had to be converted, even partially """
+        self.rows_converted = 0
+        """ number of rows converted """
+        self._lock = threading.Lock()
+        self._last_key = None
+        self._last_source = None
+        self._last_result = None
+        self._threshold_map = None
+
+    def convert(self, image, origin=(0, 0)):
+        """ Convert `image` to a mode '1' image.
+        `origin` is where the image is on the screen, so the ordered dithering
+        pattern of a cropped part of the screen lines up with the rest of it """
+        if image.mode == '1':
+            return image
+        if image.mode != 'L':
+            # Pillow's color to grayscale conversion is as fast as it gets
+            image = image.convert('L')
+        if self.mode == ORDERED:
+            # Only the position within the pattern matters
+            origin = (origin[0] % self.matrix_size, origin[1] % self.matrix_size)
+        else:
+            origin = (0, 0)
+        key = (self.mode, self.threshold, self.matrix_size, image.size, origin)
+        with self._lock:
+            if numpy is not None:
+                return self._convert_numpy(image, key)
+            return self._convert_pil(image, key)
+
+    def _convert_numpy(self, image, key):
+        width, height = image.size
+        source = numpy.asarray(image, dtype=numpy.uint8)
+        if key == self._last_key:
+            changed = numpy.flatnonzero((source != self._last_source).any(axis=1))
+            if not len(changed):
+                self.hits += 1
+                return Image.frombytes('1', (width, height), self._last_result.tobytes())
+            if self.mode == DIFFUSION or len(changed) == height:
+                changed = None
+        else:
+            changed = None
+        self.misses += 1
+        if changed is None:
+            result = self._dither_numpy(source, key, None)
+            self.rows_converted += height
+        else:
+            result = self._last_result.copy()
+            result[changed] = self._dither_numpy(source, key, changed)
+            self.rows_converted += len(changed)
+        self._last_key = key
+        self._last_source = source.copy()
+        self._last_result = result
+        return Image.frombytes('1', (width, height), result.tobytes())
+
+    def _dither_numpy(self, source, key, rows):
+        """ Dither the `rows` of `source` (all of them if None), as packed bytes """
+        if self.mode == DIFFUSION:
+            image = Image.fromarray(source, 'L').convert('1')
+            return numpy.frombuffer(image.tobytes(), dtype=numpy.uint8).reshape(
+                source.shape[0], -1).copy()
+        if rows is not None:
+            source = source[rows]
+        if self.mode == THRESHOLD:
+            white = source >= self.threshold
+        else:
+            threshold_map = self._get_threshold_map(key)
+            white = source > (threshold_map if rows is None else threshold_map[rows])
+        # Pillow pads every row to whole bytes, and so does packbits along rows
+        return numpy.packbits(white, axis=1)
+
+    def _get_threshold_map(self, key):
+        """ The ordered dithering thresholds for a whole image, tiled from the Bayer matrix """
+        if self._threshold_map is None or self._threshold_map[0] != key:
+            _, _, size, (width, height), (ox, oy) = key
+            matrix = numpy.array(_thresholds(size), dtype=numpy.uint8)
+            ys = (numpy.arange(height) + oy) % size
+            xs = (numpy.arange(width) + ox) % size
+            self._threshold_map = (key, matrix[ys[:, None], xs[None, :]])
+        return self._threshold_map[1]
+
+    def _convert_pil(self, image, key):
+        width, height = image.size
+        source = image.tobytes()
+        if key == self._last_key and source == self._last_source:
+            self.hits += 1
+            return Image.frombytes('1', (width, height), self._last_result)
+        self.misses += 1
+        if self.mode == DIFFUSION:
+            result = image.convert('1')
+        elif self.mode == THRESHOLD:
+            threshold = self.threshold
+            result = image.point([255 if v >= threshold else 0 for v in range(256)], '1')
+        else:
+            # White where the source is brighter than the threshold, done with
+            # a saturating subtraction so Pillow does the per pixel work
+            difference = ImageChops.subtract(image, self._threshold_image(key))
+            result = difference.point([255 if v > 0 else 0 for v in range(256)], '1')
+        self.rows_converted += height
+        self._last_key = key
+        self._last_source = source
+        self._last_result = result.tobytes()
+        return result
+
+    def _threshold_image(self, key):
+        """ The ordered dithering thresholds for a whole image, as an 'L' image """
+        if self._threshold_map is None or self._threshold_map[0] != key:
+            _, _, size, (width, height), (ox, oy) = key
+            tile = Image.new('L', (size, size))
+            tile.putdata([v for row in _thresholds(size) for v in row])
+            thresholds = Image.new('L', (width + size, height + size))
+            for y in range(0, height + size, size):
+                for x in range(0, width + size, size):
+                    thresholds.paste(tile, (x, y))
+            self._threshold_map = (key, thresholds.crop((ox, oy, ox + width, oy + height)))
+        return self._threshold_map[1]
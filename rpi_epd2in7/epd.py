@@ -30,11 +30,20 @@
 # THE SOFTWARE.
 from __future__ import unicode_literals, division, absolute_import
 
+import collections
+import logging
 import time
-import spidev
-from .lut import LUT, QuickLUT
-import RPi.GPIO as GPIO
-from PIL import ImageChops
+import threading
+from .backend import HardwareBackend, LOW, HIGH
+from .lut import DEFAULT_WAVEFORMS, TEMPERATURE_WAVEFORMS, select_waveforms, waveform_duration
+from .metrics import clock
+from .packing import (pack_image, xor_buffers, whitened_pixels, is_blank, crop_buffer, paste_buffer,
+                      rotate_buffer)
+from .regions import find_dirty_regions, align_region, rotate_box, refresh_overhead, MAX_REGIONS
+from .ghosting import GhostingBudget
+from .state import StateFile
+
+log = logging.getLogger(__name__)
 
 # Pin definition
 RST_PIN         = 17
@@ -42,6 +51,11 @@ DC_PIN          = 25
 CS_PIN          = 8
 BUSY_PIN        = 24
 
+Pins = collections.namedtuple('Pins', ['rst', 'dc', 'cs', 'busy'])
+""" BCM numbers of the reset, data/command, chip select and busy pins of a display """
+
+DEFAULT_PINS = Pins(RST_PIN, DC_PIN, CS_PIN, BUSY_PIN)
+
 
 # Display resolution
 EPD_WIDTH       = 176
@@ -88,6 +102,57 @@ ACTIVE_PROGRAM                              = 0xA1
 READ_OTP_DATA                               = 0xA2
 
 
+# Supported values of EPD.rotation
+ROTATIONS = (0, 90, 180, 270)
+
+# Register settings sent by init() before POWER_ON, as (command, data) pairs.
+# The specifics of how this works or what "power optimization" actually means
+# are unclear to me, so I'm leaving it as-is.
+POWER_ON_SEQUENCE = (
+    (POWER_SETTING, b'\x03\x00\x2b\x2b\x09'),  # VDS_EN VDG_EN, VCOM_HV VGHL_LV, VDH, VDL, VDHR
+    (BOOSTER_SOFT_START, b'\x07\x07\x17'),
+    # Power optimization
+    (0xF8, b'\x60\xA5'),
+    (0xF8, b'\x89\xA5'),
+    (0xF8, b'\x90\x00'),
+    (0xF8, b'\x93\x2A'),
+    (0xF8, b'\xA0\xA5'),
+    (0xF8, b'\xA1\x00'),
+    (0xF8, b'\x73\x41'),
+    (PARTIAL_DISPLAY_REFRESH, b'\x00'),
+)
+
+# Register settings sent by init() after POWER_ON
+PANEL_SEQUENCE = (
+    (PANEL_SETTING, b'\xAF'),  # KW-BF   KWR-AF    BWROTP 0f
+    (VCM_DC_SETTING_REGISTER, b'\x12'),
+)
+
+# Reset pulse timing, in milliseconds, as in Waveshare's code
+RESET_PULSE_MS = 200
+RESET_WAIT_MS = 200
+
+# SPI clock speed and mode
+SPI_SPEED_HZ = 2000000
+SPI_MODE = 0b00
+
+
+# How long to wait for the busy pin before giving up, in seconds.
+# A full refresh takes about 10 seconds.
+BUSY_TIMEOUT = 30
+
+
+# How often to read the temperature sensor when temperature compensation is on, in seconds
+TEMPERATURE_INTERVAL = 600
+
+# Readings outside of the panel's storage temperature range are treated as bogus
+TEMPERATURE_RANGE = (-25, 70)
+
+
+class BusyTimeoutError(RuntimeError):
+    """ Raised when the display stays busy for longer than expected """
+
+
 def _nearest_mult_of_8(number, up=True):
     """ Find the nearest multiple of 8, rounding up or down """
     if up:
@@ -97,208 +162,423 @@ def _nearest_mult_of_8(number, up=True):
 
 
 class EPD(object):
-    def __init__(self, partial_refresh_limit=32, fast_refresh=True):
+    def __init__(self, partial_refresh_limit=32, fast_refresh=True, backend=None,
+                 temperature_compensation=False, rotation=0, state_file=None, pins=None):
         """ Initialize the EPD class.
-        `partial_refresh_limit` - number of partial refreshes before a full refrersh is forced
+        `partial_refresh_limit` - number of partial refreshes an area can take before a full refrersh is forced
         `fast_frefresh` - enable or disable the fast refresh mode,
-                          see smart_update() method documentation for details"""
-        self.width = EPD_WIDTH
-        """ Display width, in pixels """
-        self.height = EPD_HEIGHT
-        """ Display height, in pixels """
+                          see smart_update() method documentation for details
+        `backend` - the backend.Backend used to talk to the display,
+                    defaults to the real hardware (see simulator.SimulatedBackend)
+        `temperature_compensation` - pick LUTs based on the panel's temperature sensor,
+                                     see `temperature_waveforms`
+        `rotation` - degrees (0, 90, 180 or 270) images are rotated counter-clockwise
+                     by before they're shown, 90 and 270 are for landscape images
+        `state_file` - path of a file to save what the display shows in after every update,
+                       and to pick up from when starting, see state.StateFile
+        `pins` - the Pins the display is connected to, defaults to DEFAULT_PINS.
+                 For a display on another SPI chip select, pass `backend` too,
+                 like backend.HardwareBackend(bus=0, device=1)"""
+        if rotation not in ROTATIONS:
+            raise ValueError('rotation must be one of {0}, got {1}'.format(ROTATIONS, rotation))
+        self.rotation = rotation
+        """ degrees images are rotated counter-clockwise by before they're shown """
+        self.pins = pins if pins is not None else DEFAULT_PINS
+        """ the Pins the display is connected to """
+        self.panel_width = EPD_WIDTH
+        """ Width of the panel in its native portrait orientation, in pixels """
+        self.panel_height = EPD_HEIGHT
+        """ Height of the panel in its native portrait orientation, in pixels """
         self.fast_refresh = fast_refresh
         """ enable or disable the fast refresh mode """
         self.partial_refresh_limit = partial_refresh_limit
-        """ number of partial refreshes before a full refrersh is forced """
-
-        self._last_frame = None
-        self._partial_refresh_count = 0
+        """ number of partial refreshes an area can take before a full refrersh is forced, None for no limit """
+        self.defer_cleaning = False
+        """ let smart_update() go over the refresh limits, expecting clean() to be called when idle """
+        self.ghosting = GhostingBudget(self.panel_width, self.panel_height)
+        """ ghosting.GhostingBudget tracking the partial refreshes every area of the display took """
+        self.max_partial_regions = MAX_REGIONS
+        """ maximum number of separate areas smart_update() refreshes in one update """
+        self.partial_region_overhead = None
+        """ cost of an extra partial refresh in bytes, None to work it out from how long
+        the waveform takes and `spi_speed_hz`, up to regions.REGION_OVERHEAD
+        (see regions.refresh_overhead()) """
+        self.busy_timeout = BUSY_TIMEOUT
+        """ seconds to wait for the display to become idle, None to wait forever """
+        self.busy_status_workaround = False
+        """ poll the busy pin while sending GET_STATUS, for panels that get stuck busy without it """
+        self.busy_fallbacks = 0
+        """ number of waits that timed out, and were only ended by a GET_STATUS.
+        If this goes up, set `busy_status_workaround` """
+        self.spi_speed_hz = SPI_SPEED_HZ
+        """ SPI clock speed set by init(), see calibration.calibrate() """
+        self.spi_mode = SPI_MODE
+        """ SPI mode (clock polarity and phase) set by init() """
+        self.spi_chunk_size = None
+        """ largest SPI transfer to make, None for the largest the backend supports """
+        self.reset_pulse_ms = RESET_PULSE_MS
+        """ how long reset() holds the reset pin low, in milliseconds """
+        self.reset_wait_ms = RESET_WAIT_MS
+        """ how long reset() waits for the controller to come up, in milliseconds """
+
+        self._shadow = None  # packed copy of what the panel currently shows
+        self._box_frame = None  # reused by _get_buffer_frame(), to not allocate a frame per box
         self._init_performed = False
-        self.spi = spidev.SpiDev(0, 0)
+        self._interface_ready = False  # backend.setup() was called
+        self._loaded_lut = None  # the LUT blobs currently loaded on the controller
+        self._loaded_pll = None  # the PLL_CONTROL value currently set
+        self._temperature_read_at = None
+        self.backend = backend if backend is not None else HardwareBackend()
+        """ the backend.Backend used to talk to the display """
+        self.bus_lock = threading.RLock()
+        """ held while talking over SPI, shared by displays on the same bus (see panels.PanelManager) """
+        self.metrics = None
+        """ a metrics.Metrics object to record timings and counters in, None to disable """
+        self.dither = None
+        """ a dither.Ditherer to convert images that aren't black and white, None to let Pillow do it """
+        self.temperature_waveforms = TEMPERATURE_WAVEFORMS if temperature_compensation else None
+        """ table of lut.WaveformSet to pick from by temperature, None to always use the default LUTs """
+        self.temperature_interval = TEMPERATURE_INTERVAL
+        """ seconds between temperature sensor reads """
+        self.temperature = None
+        """ last temperature read from the sensor in degrees Celsius, None if unknown """
+        self.state_file = StateFile(state_file) if state_file is not None else None
+        """ state.StateFile saved after every update, None to not save anything """
+        if self.state_file is not None:
+            self.state_file.load(self)
+
+    @property
+    def width(self):
+        """ Display width, in pixels, as seen by the images shown on it """
+        return self.panel_height if self.rotation in (90, 270) else self.panel_width
+
+    @property
+    def height(self):
+        """ Display height, in pixels, as seen by the images shown on it """
+        return self.panel_width if self.rotation in (90, 270) else self.panel_height
 
     def digital_write(self, pin, value):
-        return GPIO.output(pin, value)
+        return self.backend.write_pin(pin, value)
 
     def digital_read(self, pin):
-        return GPIO.input(pin)
+        return self.backend.read_pin(pin)
 
     def delay_ms(self, delaytime):
-        time.sleep(delaytime / 1000.0)
+        metrics = self.metrics
+        if metrics is None:
+            return self.backend.sleep(delaytime / 1000.0)
+        start = clock()
+        self.backend.sleep(delaytime / 1000.0)
+        metrics.record('delay', clock() - start)
+
+    def _spi_write(self, data):
+        metrics = self.metrics
+        if metrics is None:
+            return self.backend.spi_write(data)
+        start = clock()
+        self.backend.spi_write(data)
+        metrics.record('spi', clock() - start)
+        metrics.increment('spi_transfers')
+        metrics.increment('spi_bytes', len(data))
 
     def send_command(self, command):
-        self.digital_write(DC_PIN, GPIO.LOW)
-        self.spi.writebytes([command])
+        with self.bus_lock:
+            self.digital_write(self.pins.dc, LOW)
+            self._spi_write(bytearray([command]))
 
     def send_data(self, data):
-        self.digital_write(DC_PIN, GPIO.HIGH)
-        self.spi.writebytes([data])
+        with self.bus_lock:
+            self.digital_write(self.pins.dc, HIGH)
+            self._spi_write(bytearray([data]))
+
+    def send_data_bulk(self, data):
+        """ Send a whole buffer of data bytes, setting the DC pin only once.
+        `data` can be any sequence of byte values, it will be sent in chunks
+        that fit the spidev transfer buffer """
+        if not isinstance(data, (bytes, bytearray, memoryview)):
+            data = bytearray(data)
+        view = memoryview(data)
+        chunk_size = self.backend.max_transfer_size
+        if self.spi_chunk_size is not None:
+            chunk_size = min(chunk_size, self.spi_chunk_size)
+        with self.bus_lock:
+            self.digital_write(self.pins.dc, HIGH)
+            for start in range(0, len(view), chunk_size):
+                self._spi_write(view[start:start + chunk_size])
 
     def init(self):
         """ Preform the hardware initialization sequence """
-        # Interface initialization:
-        GPIO.setmode(GPIO.BCM)
-        GPIO.setwarnings(False)
-        GPIO.setup(RST_PIN, GPIO.OUT)
-        GPIO.setup(DC_PIN, GPIO.OUT)
-        GPIO.setup(CS_PIN, GPIO.OUT)
-        GPIO.setup(BUSY_PIN, GPIO.IN)
-
-        self.spi.max_speed_hz = 2000000
-        self.spi.mode = 0b00
+        # Interface initialization, only needed once
+        if not self._interface_ready:
+            pins = self.pins
+            with self.bus_lock:
+                self.backend.setup(outputs=(pins.rst, pins.dc, pins.cs), inputs=(pins.busy,),
+                                   spi_speed_hz=self.spi_speed_hz, spi_mode=self.spi_mode)
+            self._interface_ready = True
         # EPD hardware init
-        # The specifics of how this works or what "power optimization" actually means
-        # are unclear to me, so I'm leaving it as-is.
         self.reset()
-        self.send_command(POWER_SETTING)
-        self.send_data(0x03)                  # VDS_EN, VDG_EN
-        self.send_data(0x00)                  # VCOM_HV, VGHL_LV[1], VGHL_LV[0]
-        self.send_data(0x2b)                  # VDH
-        self.send_data(0x2b)                  # VDL
-        self.send_data(0x09)                  # VDHR
-        self.send_command(BOOSTER_SOFT_START)
-        self.send_data(0x07)
-        self.send_data(0x07)
-        self.send_data(0x17)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x60)
-        self.send_data(0xA5)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x89)
-        self.send_data(0xA5)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x90)
-        self.send_data(0x00)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x93)
-        self.send_data(0x2A)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0xA0)
-        self.send_data(0xA5)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0xA1)
-        self.send_data(0x00)
-        # Power optimization
-        self.send_command(0xF8)
-        self.send_data(0x73)
-        self.send_data(0x41)
-        self.send_command(PARTIAL_DISPLAY_REFRESH)
-        self.send_data(0x00)
+        self._send_sequence(POWER_ON_SEQUENCE)
         self.send_command(POWER_ON)
         self.wait_until_idle()
-
-        self.send_command(PANEL_SETTING)
-        self.send_data(0xAF)        # KW-BF   KWR-AF    BWROTP 0f
-        self.send_command(PLL_CONTROL)
-        self.send_data(0x3A)        # 3A 100HZ   29 150Hz 39 200HZ    31 171HZ
-        self.send_command(VCM_DC_SETTING_REGISTER)
-        self.send_data(0x12)
+        self._send_sequence(PANEL_SEQUENCE)
         self.delay_ms(2)
-        self.set_lut()
+        # The PLL and LUTs are set by the first refresh, which knows which ones it needs
         # EPD hardware init end
         self._init_performed = True
 
-    def wait_until_idle(self):
+    def wake(self):
+        """ Wake the display up after sleep().
+        Deep sleep loses everything the controller was told, so this is init()
+        without setting up the SPI bus and pins again. What the display shows
+        is still known, so the next update can be a partial refresh.
+        Updating the display wakes it up too """
+        self.init()
+
+    def _send_sequence(self, sequence):
+        """ Send a sequence of (command, data) pairs """
+        for command, data in sequence:
+            self.send_command(command)
+            self.send_data_bulk(data)
+
+    def is_busy(self):
+        """ Check if the display is busy """
+        return self.digital_read(self.pins.busy) == 0      # 0: busy, 1: idle
+
+    def _watch_busy_pin(self, callback):
+        """ Call `callback` (from another thread) when the display goes idle """
+        self.backend.watch_rising(self.pins.busy, callback)
+
+    def _unwatch_busy_pin(self):
+        self.backend.unwatch(self.pins.busy)
+
+    def wait_until_idle(self, timeout=None):
+        """ Wait until screen is idle, sleeping until the busy pin goes high.
+        `timeout` is in seconds, and defaults to `busy_timeout`.
+        Raises BusyTimeoutError if the display is still busy after `timeout` """
+        metrics = self.metrics
+        if metrics is None:
+            return self._wait_until_idle(timeout)
+        start = clock()
+        try:
+            self._wait_until_idle(timeout)
+        finally:
+            metrics.record('busy_wait', clock() - start)
+
+    def _wait_until_idle(self, timeout):
+        if timeout is None:
+            timeout = self.busy_timeout
+        if self.busy_status_workaround:
+            return self._poll_until_idle(timeout)
+
+        # Some panels only pick up the ready signal after a GET_STATUS (see
+        # _poll_until_idle()), one costs a byte and saves them the whole timeout
+        self.send_command(GET_STATUS)
+        if not self._wait_for_busy_pin(timeout):
+            self.send_command(GET_STATUS)
+            if self.is_busy():
+                raise BusyTimeoutError('Display still busy after {0} seconds'.format(timeout))
+            self._busy_fallback(timeout)
+
+    def _wait_for_busy_pin(self, timeout):
+        """ Sleep until the busy pin goes high, without sending anything to the display.
+        Returns False if it's still low after `timeout` seconds """
+        idle = threading.Event()
+        # Start watching before checking the pin, otherwise the edge
+        # could be missed if it happens right between the two
+        self._watch_busy_pin(idle.set)
+        try:
+            return not self.is_busy() or idle.wait(timeout)
+        finally:
+            self._unwatch_busy_pin()
+
+    def _busy_fallback(self, timeout):
+        """ Account for a wait that only ended with a GET_STATUS after `timeout` """
+        self.busy_fallbacks += 1
+        if self.metrics is not None:
+            self.metrics.increment('busy_fallbacks')
+        log.warning('Display only became idle after a GET_STATUS, %s seconds late. '
+                    'Setting busy_status_workaround avoids the wait', timeout)
+
+    def _poll_until_idle(self, timeout):
         """ Wait until screen is idle by polling the busy pin """
         # HACK: fix e-Paper not picking up ready signal and getting stuck in busy state
         # https://github.com/waveshare/e-Paper/issues/30#issuecomment-640254220
-        self.send_command(0x71)
-        while(self.digital_read(BUSY_PIN) == 0):      # 0: busy, 1: idle
-            self.send_command(0x71)
-            self.delay_ms(50)
+        deadline = None if timeout is None else time.time() + timeout
+        self.send_command(GET_STATUS)
+        while self.is_busy():
+            if deadline is not None and time.time() > deadline:
+                raise BusyTimeoutError('Display still busy after {0} seconds'.format(timeout))
+            self.send_command(GET_STATUS)
+            self.backend.sleep(0.05)
 
     def reset(self):
         """ Module reset """
-        self.digital_write(RST_PIN, GPIO.LOW)
-        self.delay_ms(200)
-        self.digital_write(RST_PIN, GPIO.HIGH)
-        self.delay_ms(200)
-
-    def set_lut(self, fast=False):
+        self._loaded_lut = None
+        self._loaded_pll = None
+        self.digital_write(self.pins.rst, LOW)
+        self.delay_ms(self.reset_pulse_ms)
+        self.digital_write(self.pins.rst, HIGH)
+        self.delay_ms(self.reset_wait_ms)
+
+    def set_lut(self, fast=False, force=False):
         """ Set LUT for the controller.
-        If `fast` is srt to True, quick update LUTs from Ben Krasnow will be used"""
-        lut_to_use = LUT if not fast else QuickLUT
+        If `fast` is srt to True, quick update LUTs from Ben Krasnow will be used.
+        Nothing is sent if the LUT is already loaded, unless `force` is True.
+        Returns True if the LUT was uploaded """
+        waveforms = self._get_waveforms()
+        self._set_pll(waveforms.pll)
+        blobs = waveforms.normal if not fast else waveforms.quick
+        if blobs is self._loaded_lut and not force:
+            return False
+        if self.metrics is not None:
+            self.metrics.increment('fast_lut_uploads' if fast else 'lut_uploads')
 
         # Quick LUTs courtsey of Ben Krasnow:
         # http://benkrasnow.blogspot.co.il/2017/10/fast-partial-refresh-on-42-e-paper.html
         # https://www.youtube.com/watch?v=MsbiO8EAsGw
 
-        self.send_command(LUT_FOR_VCOM)               # vcom
-        for byte in lut_to_use.lut_vcom_dc:
-            self.send_data(byte)
-
-        self.send_command(LUT_WHITE_TO_WHITE)         # ww --
-        for byte in lut_to_use.lut_ww:
-            self.send_data(byte)
-
-        self.send_command(LUT_BLACK_TO_WHITE)         # bw r
-        for byte in lut_to_use.lut_bw:
-            self.send_data(byte)
-
-        self.send_command(LUT_WHITE_TO_BLACK)         # wb w
-        for byte in lut_to_use.lut_wb:
-            self.send_data(byte)
-
-        self.send_command(LUT_BLACK_TO_BLACK)         # bb b
-        for byte in lut_to_use.lut_bb:
-            self.send_data(byte)
+        # If sending fails halfway, the controller has some mix of both
+        self._loaded_lut = None
+        for command, payload in blobs:  # vcom, ww, bw, wb, bb
+            self.send_command(command)
+            self.send_data_bulk(payload)
+        self._loaded_lut = blobs
+        return True
+
+    def _set_pll(self, value):
+        """ Set the frame rate the waveforms are played at """
+        if value == self._loaded_pll:
+            return
+        self._loaded_pll = None
+        self.send_command(PLL_CONTROL)
+        self.send_data(value)       # 3A 100HZ   29 150Hz 39 200HZ    31 171HZ
+        self._loaded_pll = value
+
+    def _get_waveforms(self):
+        """ Get the lut.WaveformSet to use, reading the temperature sensor when it's due """
+        if self.temperature_waveforms is None:
+            return DEFAULT_WAVEFORMS
+        now = time.time()
+        if self._temperature_read_at is None or now - self._temperature_read_at >= self.temperature_interval:
+            self._temperature_read_at = now
+            temperature = self.read_temperature()
+            if temperature is not None:
+                self.temperature = temperature
+        return select_waveforms(self.temperature_waveforms, self.temperature)
+
+    def read_temperature(self):
+        """ Read the panel's temperature sensor.
+        Returns the temperature in degrees Celsius, or None if it couldn't be read.
+
+        The controller answers over the SPI data line, which requires the
+        backend to support 3-wire (bidirectional) SPI """
+        self.wait_until_idle()
+        self.send_command(TEMPERATURE_SENSOR_COMMAND)
+        # The answer is to the last command sent, so wait for the measurement
+        # without the GET_STATUS wait_until_idle() might send
+        if not self._wait_for_busy_pin(self.busy_timeout):
+            return None
+        try:
+            with self.bus_lock:
+                self.digital_write(self.pins.dc, HIGH)
+                data = bytearray(self.backend.spi_read(2))
+        except (IOError, OSError, NotImplementedError):
+            return None
+        if data == b'\xff\xff':
+            return None  # nothing drove the data line
+        # 11 bit two's complement value, in 1/8 degree steps
+        raw = (data[0] << 3) | (data[1] >> 5)
+        if raw & 0x400:
+            raw -= 0x800
+        temperature = raw / 8
+        if not TEMPERATURE_RANGE[0] <= temperature <= TEMPERATURE_RANGE[1]:
+            return None
+        return temperature
 
     def _get_frame_buffer(self, image):
         """ Get a full frame buffer from a PIL Image object """
-        image_monocolor = image.convert('1')
+        image_monocolor = self._convert(image)
         imwidth, imheight = image_monocolor.size
         if imwidth != self.width or imheight != self.height:
             raise ValueError('Image must be same dimensions as display \
                 ({0}x{1}).' .format(self.width, self.height))
-        return self._get_frame_buffer_for_size(image_monocolor, self.height, self.width)
+        frame_buffer = self._get_frame_buffer_for_size(image_monocolor, self.height, self.width)
+        return self._rotate_buffer(frame_buffer, self.width, self.height)
+
+    def _convert(self, image, origin=(0, 0)):
+        """ Convert `image`, which is at `origin` on the display, to mode '1' """
+        metrics = self.metrics
+        start = clock() if metrics is not None else None
+        if self.dither is not None:
+            image_monocolor = self.dither.convert(image, origin)
+        else:
+            image_monocolor = image.convert('1')
+        if start is not None:
+            metrics.record('convert', clock() - start)
+        return image_monocolor
 
     def _get_frame_buffer_for_size(self, image_monocolor, height, width):
-        """ Get a frame buffer object from a PIL Image object assuming a specific size"""
-        buf = [0x00] * (width * height // 8)
-        pixels = image_monocolor.load()
-        for y in range(height):
-            for x in range(width):
-                # Set the bits for the column of pixels at the current position
-                if pixels[x, y] != 0:
-                    buf[(x + y * width) // 8] |= (0x80 >> (x % 8))
-        return buf
+        """ Get a frame buffer bytearray from a PIL Image object assuming a specific size"""
+        if image_monocolor.size != (width, height):
+            raise ValueError('Image must be {0}x{1}, got {2}x{3}'.format(
+                width, height, *image_monocolor.size))
+        metrics = self.metrics
+        if metrics is None:
+            return pack_image(image_monocolor)
+        start = clock()
+        frame_buffer = pack_image(image_monocolor)
+        metrics.record('pack', clock() - start)
+        return frame_buffer
+
+    def _rotate_buffer(self, frame_buffer, width, height):
+        """ Rotate a packed `width`x`height` buffer the way the panel shows it """
+        if not self.rotation:
+            return frame_buffer
+        metrics = self.metrics
+        if metrics is None:
+            return rotate_buffer(frame_buffer, width, height, self.rotation)
+        start = clock()
+        frame_buffer = rotate_buffer(frame_buffer, width, height, self.rotation)
+        metrics.record('pack', clock() - start)
+        return frame_buffer
 
     def display_frame(self, image):
         """ Display a full frame, doing a full screen refresh """
+        self._display_frame_buffer(self._get_frame_buffer(image))
+
+    def _display_frame_buffer(self, frame_buffer):
+        """ Display a packed full frame buffer, doing a full screen refresh """
         if not self._init_performed:
             # Initialize the hardware if it wasn't already initialized
             self.init()
         self.set_lut()
-        frame_buffer = self._get_frame_buffer(image)
         self.send_command(DATA_START_TRANSMISSION_1)
         self.delay_ms(2)
-        for _ in range(0, self.width * self.height // 8):
-            self.send_data(0xFF)
+        self.send_data_bulk(b'\xff' * (self.panel_width * self.panel_height // 8))
         self.delay_ms(2)
         self.send_command(DATA_START_TRANSMISSION_2)
         self.delay_ms(2)
-        for i in range(0, self.width * self.height // 8):
-            self.send_data(frame_buffer[i])
+        self.send_data_bulk(frame_buffer)
         self.delay_ms(2)
         self.send_command(DISPLAY_REFRESH)
         self.wait_until_idle()
-        self._last_frame = image.copy()
-        self._partial_refresh_count = 0  # reset the partial refreshes counter
+        if self.metrics is not None:
+            self.metrics.increment('full_refreshes')
+        # Copied, so callers can reuse their buffers
+        if self._shadow is None:
+            self._shadow = bytearray(frame_buffer)
+        else:
+            self._shadow[:] = frame_buffer
+        self.ghosting.reset()
+        self._save_state()
 
     def _send_partial_frame_dimensions(self, x, y, l, w):
-        self.send_data(x >> 8)
-        self.send_data(x & 0xf8)
-        self.send_data(y >> 8)
-        self.send_data(y & 0xff)
-        self.send_data(w >> 8)
-        self.send_data(w & 0xf8)
-        self.send_data(l >> 8)
-        self.send_data(l & 0xff)
+        self.send_data_bulk(bytearray([
+            x >> 8, x & 0xf8,
+            y >> 8, y & 0xff,
+            w >> 8, w & 0xf8,
+            l >> 8, l & 0xff,
+        ]))
 
     def display_partial_frame(self, image, x, y, h, w, fast=False):
         """ Display a partial frame, only refreshing the changed area.
@@ -309,19 +589,67 @@ class EPD(object):
         `w` is the width of the area to update.
 
 
+        Coordinates are in the image, they are translated to the panel's
+        according to `rotation`.
+
         if `fast` is True, fast refresh lookup tables will be used.
         see `smart_update()` method documentation for details."""
-        if fast:
-            self.set_lut(fast=True)
-            self.delay_ms(2)
-
+        region = self._get_partial_region(x, y, h, w)
+        self._display_partial_buffer(self._get_partial_buffer(image, region), region, fast)
+
+    def _get_partial_buffer(self, image, region):
+        """ Get the packed frame buffer for the panel `region` out of a full size image """
+        x0, y0, x1, y1 = box = rotate_box(region, self.panel_width, self.panel_height,
+                                          (360 - self.rotation) % 360)
+        cropped = self._convert(image.crop(box), (x0, y0))
+        new_fb = self._get_frame_buffer_for_size(cropped, y1 - y0, x1 - x0)
+        return self._rotate_buffer(new_fb, x1 - x0, y1 - y0)
+
+    def _panel_region(self, box):
+        """ Get the smallest region of the panel the controller can refresh, that
+        covers the (x0, y0, x1, y1) `box` of the image.
+        Returns None if the box is off screen """
+        x0, y0, x1, y1 = rotate_box(box, self.width, self.height, self.rotation)
+        if self.rotation in (90, 270):
+            # The panel's rows are the image's columns, and rotating a buffer
+            # needs whole bytes in both directions
+            y0 = _nearest_mult_of_8(int(y0), False)
+            y1 = _nearest_mult_of_8(int(y1))
+        return align_region((x0, y0, x1, y1), self.panel_width, self.panel_height)
+
+    def _get_partial_region(self, x, y, h, w):
+        """ Get the (x0, y0, x1, y1) panel region the controller can actually refresh
+        for the area requested by the caller """
         # According to the spec, x and w have to be multiples of 8.
-        # round them up and down accordingly to make sure they fit the requirement
-        # adding a few more pixels to the refreshed area.
+        # The area is rounded out to fit the requirement, adding a few more
+        # pixels to the refreshed area.
         # This is mandatory, otherwise the display might get corrupted until
         # the next valid update that touches the same area.
-        x = _nearest_mult_of_8(x, False)
-        w = _nearest_mult_of_8(w)
+        region = self._panel_region((x, y, x + w, y + h))
+        if region is None:
+            raise ValueError('Area is outside of the display')
+        return region
+
+    def _display_partial_buffer(self, new_fb, region, fast=False):
+        """ Display the packed frame buffer `new_fb` in `region`, doing a partial refresh """
+        x, y, x1, y1 = region
+        w = x1 - x
+        h = y1 - y
+        # The old values are sent too, as per spec, straight from the shadow buffer
+        old_fb = crop_buffer(self._shadow, self.panel_width, region)
+        self._send_partial_frame(old_fb, new_fb, x, y, h, w, fast)
+        paste_buffer(self._shadow, self.panel_width, region, new_fb)
+        self._save_state()
+
+    def _send_partial_frame(self, old_fb, new_fb, x, y, h, w, fast):
+        """ Send the old and new frame buffers of an area and refresh it.
+        `x` and `w` must already be multiples of 8 """
+        if not self._init_performed:
+            self.init()
+        # The fast LUT is left loaded afterwards, so consecutive fast refreshes
+        # don't have to upload it every time
+        if self.set_lut(fast=fast):
+            self.delay_ms(2)
 
         self.send_command(PARTIAL_DATA_START_TRANSMISSION_1)
         self.delay_ms(2)
@@ -329,11 +657,7 @@ class EPD(object):
         self._send_partial_frame_dimensions(x, y, h, w)
         self.delay_ms(2)
 
-        # Send the old values, as per spec
-        old_image = self._last_frame.crop((x, y, x+w, y+h))
-        old_fb = self._get_frame_buffer_for_size(old_image, h, w)
-        for i in range(0, w * h // 8):
-            self.send_data(old_fb[i])
+        self.send_data_bulk(old_fb)
         self.delay_ms(2)
 
         self.send_command(PARTIAL_DATA_START_TRANSMISSION_2)
@@ -342,20 +666,18 @@ class EPD(object):
         self._send_partial_frame_dimensions(x, y, h, w)
 
         # Send new data
-        self._last_frame = image.copy()
-        image = image.crop((x, y, x+w, y+h))
-        new_fb = self._get_frame_buffer_for_size(image, h, w)
-        for i in range(0, w * h // 8):
-            self.send_data(new_fb[i])
+        self.send_data_bulk(new_fb)
         self.delay_ms(2)
 
         self.send_command(PARTIAL_DISPLAY_REFRESH)
         self.delay_ms(2)
         self._send_partial_frame_dimensions(x, y, h, w)
         self.wait_until_idle()
-        if fast:
-            self.set_lut()  # restore LUT to normal mode
-        self._partial_refresh_count += 1
+        self.ghosting.record((x, y, x + w, y + h), fast)
+        if self.metrics is not None:
+            self.metrics.increment('partial_refreshes')
+            if fast:
+                self.metrics.increment('fast_refreshes')
 
     def smart_update(self, image):
         """ Display a frame, automatically deciding which refresh method to use.
@@ -367,45 +689,169 @@ class EPD(object):
         gray instead of black, and can cause burn-in if it's overused.
 
         It's recommended to do a full flush "soon" after using the fast mode,
-        to avoid degrading the panel. You can tweak `partial_refresh_limit`
-        or
+        to avoid degrading the panel. Areas are only fast refreshed up to
+        `ghosting.ghosting_limit` times in a row, and a full flush is done once
+        an area took `partial_refresh_limit` partial refreshes. You can tweak
+        these or disable `fast_refresh` entirely.
+
+        If `defer_cleaning` is True, the full flush is put off (up to twice
+        as long), expecting clean() to be called when the display is idle.
+
+        Changes in areas far apart from each other are refreshed separately,
+        up to `max_partial_regions` areas per update.
         """
-        if self._last_frame is None or self._partial_refresh_count == self.partial_refresh_limit:
+        self._smart_update_buffer(self._get_frame_buffer(image))
+
+    def display_buffer(self, data, box=None):
+        """ Display a packed frame, doing a full screen refresh. This skips Pillow entirely.
+
+        `data` is any bytes-like object (bytes, bytearray, memoryview...) with one bit
+        per pixel, rows one after the other, the leftmost pixel of every byte in the
+        most significant bit, and set bits for white pixels. That's what Pillow's
+        tobytes() gives for a mode '1' image `width` pixels wide.
+        It's copied, so it can be reused as soon as this returns.
+
+        If `box` is given, `data` only covers that (x0, y0, x1, y1) box, and the rest
+        of the display stays as it is. x0 and x1 must be multiples of 8,
+        and with `rotation` 90 or 270, so must y0 and y1 """
+        self._display_frame_buffer(self._get_buffer_frame(data, box))
+
+    def smart_update_buffer(self, data, box=None):
+        """ smart_update() for a packed frame, or a packed `box` of it, see display_buffer() """
+        self._smart_update_buffer(self._get_buffer_frame(data, box))
+
+    def _get_buffer_frame(self, data, box):
+        """ Get the panel's full frame buffer from packed data in the images' orientation.
+        For a box, that's a buffer shared by all calls, only good until the next one """
+        if box is None:
+            box = (0, 0, self.width, self.height)
+        x0, y0, x1, y1 = box
+        if (x0 % 8 or x1 % 8 or (self.rotation in (90, 270) and (y0 % 8 or y1 % 8)) or
+                not (0 <= x0 < x1 <= self.width and 0 <= y0 < y1 <= self.height)):
+            raise ValueError('Invalid box for packed data: {0}'.format(box))
+        size = (x1 - x0) // 8 * (y1 - y0)
+        if len(data) != size:
+            raise ValueError('Expected {0} bytes of packed data, got {1}'.format(size, len(data)))
+        data = self._rotate_buffer(data, x1 - x0, y1 - y0)
+        if box == (0, 0, self.width, self.height):
+            return data
+        if self._box_frame is None:
+            self._box_frame = bytearray(self.panel_width * self.panel_height // 8)
+        frame = self._box_frame
+        if self._shadow is not None:
+            frame[:] = self._shadow
+        else:
+            frame[:] = b'\xff' * len(frame)
+        region = rotate_box(box, self.width, self.height, self.rotation)
+        paste_buffer(frame, self.panel_width, region, data)
+        return frame
+
+    def _needs_full_refresh(self):
+        """ Check if smart_update() has to do a full refresh """
+        wear_limit = self.partial_refresh_limit
+        if wear_limit is not None and self.defer_cleaning:
+            wear_limit *= 2
+        return self._shadow is None or self.ghosting.needs_full_refresh(wear_limit)
+
+    def _smart_update_buffer(self, new_frame, regions=None):
+        """ smart_update() for a packed full frame buffer.
+        `regions` are the _changed_regions() from what the display shows, if they're already known """
+        if self._needs_full_refresh():
             # Doing a full refresh when:
             # - No frame has been displayed in this run, do a full refresh
-            # - The display has been partially refreshed more than LIMIT times
-            # the last full refresh (to prevent burn-in)
-            self.display_frame(image)
+            # - Some area of the display has been partially refreshed more
+            # than LIMIT times since the last full refresh (to prevent burn-in)
+            self._display_frame_buffer(new_frame)
         else:
-            # Partial update. Let's start by figuring out the bounding box
-            # of the changed area
-            difference = ImageChops.difference(self._last_frame, image)
-            bbox = difference.getbbox()
-            if bbox is not None:
-                # the old picture and new picture are different, partial
-                # update is needed.
-                # Get the update area. x and w have to be multiples of 8
-                # as per the spec, so round down for x, and round up for w
-                x = _nearest_mult_of_8(bbox[0], False)
-                y = bbox[1]
-                w = _nearest_mult_of_8(bbox[2] - x)
-                if w > self.width:
-                    w = self.width
-                h = bbox[3] - y
-                if h > self.height:
-                    h = self.height
-                # now let's figure out if fast mode is an option.
-                # If the area was all white before - fast mode will be used.
-                # otherwise, a slow refresh will be used (to avoid ghosting).
-                # Since the image only has one color, meaning each pixel is either
-                # 0 or 255, the following convinent one liner can be used
-                fast = 0 not in self._last_frame.crop(bbox).getdata() and self.fast_refresh
-                self.display_partial_frame(image, x, y, h, w, fast)
+            # Partial update. Let's start by figuring out which areas of
+            # the screen changed. Areas that are far apart are refreshed
+            # separately, so a change at the top and a change at the bottom
+            # don't cause everything in between to be sent and re-driven.
+            if regions is None:
+                regions = self._changed_regions(self._shadow, new_frame)
+            if not regions:
+                return
+            # Regions can overlap, so compare every one to what the ones before it left.
+            # The regions cover every change, so this leaves the shadow buffer equal to new_frame
+            for region in regions:
+                old_fb = bytes(crop_buffer(self._shadow, self.panel_width, region))
+                new_fb = crop_buffer(new_frame, self.panel_width, region)
+                if old_fb == new_fb:
+                    continue
+                self._smart_update_region(region, old_fb, new_fb)
+                paste_buffer(self._shadow, self.panel_width, region, new_fb)
+            self._save_state()
+
+    def _changed_regions(self, old_frame, new_frame):
+        """ Get the regions smart_update() refreshes to go from one full frame buffer to another,
+        in the order they're refreshed """
+        if new_frame == old_frame:
+            return []
+        diff = xor_buffers(old_frame, new_frame)
+        if not self.fast_refresh:
+            return find_dirty_regions(diff, self.panel_width, self.panel_height,
+                                      self._region_overhead(False),
+                                      self.max_partial_regions)
+        return self.ghosting.plan_regions(diff, whitened_pixels(old_frame, new_frame),
+                                          self._region_overhead(False),
+                                          self.max_partial_regions,
+                                          self._region_overhead(True))
+
+    def _region_overhead(self, fast):
+        """ Get the cost of an extra partial refresh with the quick LUT if `fast` is set,
+        or the normal one otherwise, in bytes """
+        if self.partial_region_overhead is not None:
+            return self.partial_region_overhead
+        if self.temperature_waveforms is None:
+            waveforms = DEFAULT_WAVEFORMS
+        else:
+            waveforms = select_waveforms(self.temperature_waveforms, self.temperature)
+        blobs = waveforms.quick if fast else waveforms.normal
+        return refresh_overhead(waveform_duration(blobs, waveforms.pll), self.spi_speed_hz)
+
+    def _smart_update_region(self, region, old_fb, new_fb):
+        """ Partially refresh `region` from `old_fb` to `new_fb`, picking the refresh mode.
+        Doesn't update the shadow buffer """
+        x, y, x1, y1 = region
+        # now let's figure out if fast mode is an option.
+        # If no pixel turns from black to white, and the area wasn't fast
+        # refreshed too many times in a row - fast mode will be used.
+        # otherwise, a slow refresh will be used (to avoid ghosting).
+        fast = (self.fast_refresh and is_blank(whitened_pixels(old_fb, new_fb)) and
+                self.ghosting.can_refresh_fast(region))
+        self._send_partial_frame(old_fb, new_fb, x, y, y1 - y, x1 - x, fast)
+
+    def clean(self):
+        """ Clean up after partial refreshes, meant to be called when the display is idle.
+        Does a full refresh if an area took `partial_refresh_limit` partial refreshes,
+        otherwise refreshes the areas that were fast refreshed with the normal LUT.
+        Returns True if anything was refreshed """
+        if self._shadow is None:
+            return False
+        if self.ghosting.needs_full_refresh(self.partial_refresh_limit):
+            self._display_frame_buffer(self._shadow)
+            return True
+        regions = self.ghosting.ghosted_regions(self._region_overhead(False),
+                                                self.max_partial_regions)
+        for region in regions:
+            x, y, x1, y1 = region
+            frame_buffer = crop_buffer(self._shadow, self.panel_width, region)
+            self._send_partial_frame(frame_buffer, frame_buffer, x, y, y1 - y, x1 - x, False)
+        if regions:
+            self._save_state()
+        return bool(regions)
+
+    def _save_state(self):
+        """ Save the display's state to `state_file`, if there is one """
+        if self.state_file is not None:
+            self.state_file.save(self)
 
     def sleep(self):
         """Put the chip into a deep-sleep mode to save power.
         The deep sleep mode would return to standby by hardware reset.
-        Use EPD.reset() to awaken and use EPD.init() to initialize. """
+        Use EPD.wake() to awaken, or just display something. """
+        self._loaded_lut = None  # the controller needs a reset and init() to wake up
+        self._init_performed = False
         self.send_command(DEEP_SLEEP)
         self.delay_ms(2)
         self.send_data(0xa5)  # deep sleep requires 0xa5 as a "check code" parameter
@@ -0,0 +1,181 @@
+""" ghosting.py - keep track of where partial refreshes wore the display down """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import functools
+import operator
+
+from .regions import find_dirty_regions, absorb_regions, merge_regions
+
+# The screen is split into tiles, and two things are counted for every tile:
+#
+# - ghosting: fast refreshes since the tile was last driven with the normal
+#   LUT. The quick LUT skips the flush cycle, so every fast refresh leaves a
+#   bit more of the previous image behind. A partial refresh with the normal
+#   LUT cleans the tile up.
+# - wear: partial refreshes of any kind since the last full refresh. Only a
+#   full refresh gets the whole panel back into a known state.
+#
+# This way a clock ticking in a corner only wears down the corner, instead of
+# counting as much as redrawing the entire screen.
+#
+# Tiles are also what decides how a change is refreshed. The quick LUT darkens
+# white pixels fine, but pixels it turns from black to white keep a shadow of
+# what was there. Tiles where nothing turns white are fast refreshed, and only
+# the tiles with pixels turning white (or at their ghosting limit) go through
+# the normal LUT.
+
+TILE_WIDTH = 16
+TILE_HEIGHT = 16
+
+GHOSTING_LIMIT = 8
+""" Default number of fast refreshes a tile can take before it must be refreshed with the normal LUT """
+
+
+class GhostingBudget(object):
+    """ Per-tile count of fast refreshes and partial refreshes """
+
+    def __init__(self, width, height, ghosting_limit=GHOSTING_LIMIT):
+        """ `width` and `height` are the display size in pixels """
+        self.width = width
+        self.height = height
+        self.ghosting_limit = ghosting_limit
+        """ fast refreshes a tile can take before it must be refreshed with the normal LUT """
+        self.columns = (width + TILE_WIDTH - 1) // TILE_WIDTH
+        self.rows = (height + TILE_HEIGHT - 1) // TILE_HEIGHT
+        self.reset()
+
+    def reset(self):
+        """ Forget everything, after a full refresh """
+        self.ghosting = [0] * (self.columns * self.rows)
+        """ fast refreshes every tile took since it was last refreshed with the normal LUT, row by row """
+        self.wear = [0] * (self.columns * self.rows)
+        """ partial refreshes every tile took since the last full refresh, row by row """
+
+    def _tiles(self, region, inside=False):
+        """ Indexes of the tiles touching `region`, or entirely inside of it """
+        x0, y0, x1, y1 = region
+        if inside:
+            # A tile sticking out of the screen only needs its visible part covered
+            columns = range((x0 + TILE_WIDTH - 1) // TILE_WIDTH, self.columns)
+            rows = range((y0 + TILE_HEIGHT - 1) // TILE_HEIGHT, self.rows)
+            columns = [c for c in columns if min((c + 1) * TILE_WIDTH, self.width) <= x1]
+            rows = [r for r in rows if min((r + 1) * TILE_HEIGHT, self.height) <= y1]
+        else:
+            columns = range(x0 // TILE_WIDTH, (x1 + TILE_WIDTH - 1) // TILE_WIDTH)
+            rows = range(y0 // TILE_HEIGHT, (y1 + TILE_HEIGHT - 1) // TILE_HEIGHT)
+        return [row * self.columns + column for row in rows for column in columns]
+
+    def record(self, region, fast):
+        """ Account for a partial refresh of `region` """
+        for tile in self._tiles(region):
+            self.wear[tile] += 1
+            if fast:
+                self.ghosting[tile] += 1
+        if not fast:
+            for tile in self._tiles(region, inside=True):
+                self.ghosting[tile] = 0
+
+    def can_refresh_fast(self, region):
+        """ Check if `region` can take another fast refresh """
+        return all(self.ghosting[tile] < self.ghosting_limit for tile in self._tiles(region))
+
+    def needs_full_refresh(self, wear_limit):
+        """ Check if a tile took `wear_limit` partial refreshes (None for no limit) """
+        if wear_limit is None:
+            return False
+        return max(self.wear) >= wear_limit
+
+    def ghosted_regions(self, overhead, max_regions):
+        """ Get the regions that were fast refreshed since they were last cleaned up,
+        as a list of (x0, y0, x1, y1) boxes """
+        mask = bytearray(self.width * self.height // 8)
+        stride = self.width // 8
+        tile_bytes = TILE_WIDTH // 8
+        for tile, count in enumerate(self.ghosting):
+            if not count:
+                continue
+            row, column = divmod(tile, self.columns)
+            for y in range(row * TILE_HEIGHT, min((row + 1) * TILE_HEIGHT, self.height)):
+                start = y * stride + column * tile_bytes
+                end = min(start + tile_bytes, (y + 1) * stride)
+                mask[start:end] = b'\xff' * (end - start)
+        return find_dirty_regions(mask, self.width, self.height, overhead, max_regions)
+
+    def plan_regions(self, diff, whitened, overhead, max_regions, fast_overhead=None):
+        """ Split changed pixels into regions to refresh with the normal LUT and regions to fast refresh.
+        `diff` is a packed difference buffer of the whole display, `whitened` marks the pixels
+        turning from black to white (see packing.whitened_pixels()). `overhead` and `fast_overhead`
+        are the costs of an extra normal and fast refresh (see regions.refresh_overhead()).
+        Returns a list of at most `max_regions` (x0, y0, x1, y1) regions in the order they should
+        be refreshed: the ones that need the normal LUT, then the ones that can be fast refreshed.
+        A normal refresh takes as long no matter its size, so changes in the tiles next to one are refreshed with it """
+        stride = self.width // 8
+        tile_bytes = TILE_WIDTH // 8
+        slow = bytearray(len(diff))
+        fast = bytearray(diff)
+        for row in range(self.rows):
+            start = row * TILE_HEIGHT * stride
+            end = min((row + 1) * TILE_HEIGHT, self.height) * stride
+            band = bytes(diff[start:end])
+            if not band.strip(b'\x00'):
+                continue
+            changed = _or_rows(band, stride)
+            turned_white = _or_rows(whitened[start:end], stride)
+            for column in range(self.columns):
+                first = column * tile_bytes
+                if not changed[first:first + tile_bytes].strip(b'\x00'):
+                    continue
+                if (not turned_white[first:first + tile_bytes].strip(b'\x00') and
+                        self.ghosting[row * self.columns + column] < self.ghosting_limit):
+                    continue
+                for offset in range(start + first, end, stride):
+                    slow[offset:offset + tile_bytes] = diff[offset:offset + tile_bytes]
+                    fast[offset:offset + tile_bytes] = bytes(bytearray(tile_bytes))
+        if fast_overhead is None:
+            fast_overhead = overhead
+        slow_regions = find_dirty_regions(slow, self.width, self.height, overhead, max_regions)
+        fast_regions = find_dirty_regions(fast, self.width, self.height, fast_overhead, max_regions)
+        # Fast regions overlapping a normal one, or in a tile next to it,
+        # are refreshed with it, since it takes just as long either way
+        margin = (TILE_WIDTH, TILE_HEIGHT)
+        slow_regions, fast_regions = absorb_regions(slow_regions, fast_regions, margin, overhead, max_regions)
+        spare = max(max_regions, 1) - len(slow_regions)
+        if len(fast_regions) > spare > 0:
+            # Merged fast regions might now reach into a normal one
+            fast_regions = merge_regions(fast_regions, fast_overhead, spare)
+            slow_regions, fast_regions = absorb_regions(slow_regions, fast_regions, margin, overhead, max_regions)
+        if len(slow_regions) + len(fast_regions) > max(max_regions, 1):
+            # Out of refreshes, so the rest goes with the normal ones
+            slow_regions = slow_regions + fast_regions
+            fast_regions = []
+        # Regions that grew might be cheaper to refresh together now
+        slow_regions = merge_regions(slow_regions, overhead, max_regions)
+        slow_regions, fast_regions = absorb_regions(slow_regions, fast_regions, margin, overhead, max_regions)
+        return slow_regions + fast_regions
+
+
+def _or_rows(rows, stride):
+    """ OR together the rows of a packed buffer `stride` bytes wide """
+    rows = bytes(rows)
+    combined = functools.reduce(operator.or_, (int.from_bytes(rows[start:start + stride], 'big')
+                                               for start in range(0, len(rows), stride)))
+    return combined.to_bytes(stride, 'big')
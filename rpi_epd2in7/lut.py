@@ -26,6 +26,9 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
 # THE SOFTWARE.
 #
+from __future__ import unicode_literals, division, absolute_import
+
+import collections
 
 
 class LUT(object):
@@ -135,3 +138,84 @@ class QuickLUT(object):
         0x00, 0x00, 0x00, 0x00, 0x00, 0x00,
         0x00, 0x00, 0x00, 0x00, 0x00, 0x00]
 
+
+# Registers the tables are uploaded to, see LUT_FOR_VCOM and friends in epd.py
+_LUT_REGISTERS = (
+    (0x20, 'lut_vcom_dc'),
+    (0x21, 'lut_ww'),
+    (0x22, 'lut_bw'),
+    (0x23, 'lut_wb'),
+    (0x24, 'lut_bb'),
+)
+
+
+def serialize(lut):
+    """ Get a tuple of (command, payload bytes) pairs that upload the tables of `lut` """
+    return tuple((command, bytes(bytearray(getattr(lut, attribute))))
+                 for command, attribute in _LUT_REGISTERS)
+
+
+LUT_BLOBS = serialize(LUT)
+""" The normal LUT, ready to be sent """
+
+QUICK_LUT_BLOBS = serialize(QuickLUT)
+""" The quick LUT, ready to be sent """
+
+
+# PLL_CONTROL values, setting the frame rate the waveforms are played at
+PLL_100HZ = 0x3A
+PLL_150HZ = 0x29
+
+# Frame rates for the PLL_CONTROL values documented in the specification
+PLL_FRAME_RATES = {0x29: 150, 0x31: 171, 0x39: 200, 0x3A: 100}
+DEFAULT_FRAME_RATE = 100
+
+
+def waveform_frames(table):
+    """ Number of frames a pixel LUT (ww, bw, wb or bb) takes to play.
+    Every 6 byte group is a level selection byte, four phase lengths
+    and a repeat count """
+    table = bytearray(table)
+    frames = 0
+    for start in range(0, len(table) - 5, 6):
+        frames += sum(table[start + 1:start + 5]) * table[start + 5]
+    return frames
+
+
+def waveform_duration(blobs, pll):
+    """ How long a refresh with the serialized LUT `blobs` takes, in seconds,
+    with the PLL_CONTROL value `pll` """
+    frames = max(waveform_frames(payload) for command, payload in blobs
+                 if command != _LUT_REGISTERS[0][0])
+    return frames / PLL_FRAME_RATES.get(pll, DEFAULT_FRAME_RATE)
+
+
+WaveformSet = collections.namedtuple('WaveformSet', ['min_temperature', 'normal', 'quick', 'pll'])
+""" LUTs to use from `min_temperature` (in degrees Celsius, None for no lower bound)
+up to the next set's `min_temperature`.
+`normal` and `quick` are serialized LUTs, `pll` is the PLL_CONTROL value to use with them """
+
+DEFAULT_WAVEFORMS = WaveformSet(None, LUT_BLOBS, QUICK_LUT_BLOBS, PLL_100HZ)
+""" The waveforms used when the temperature is unknown or not checked """
+
+TEMPERATURE_WAVEFORMS = (
+    # The quick LUT is too short to move cold ink, which leaves a faint,
+    # ghosted image, so below 5C even fast refreshes use the normal LUT
+    WaveformSet(None, LUT_BLOBS, LUT_BLOBS, PLL_100HZ),
+    WaveformSet(5, LUT_BLOBS, QUICK_LUT_BLOBS, PLL_100HZ),
+    # Warm ink responds faster, play the same waveforms at a higher frame rate
+    WaveformSet(25, LUT_BLOBS, QUICK_LUT_BLOBS, PLL_150HZ),
+)
+""" Default temperature compensation table, sorted by `min_temperature` """
+
+
+def select_waveforms(table, temperature):
+    """ Get the WaveformSet from `table` to use at `temperature`.
+    Returns DEFAULT_WAVEFORMS if `temperature` is None """
+    if temperature is None:
+        return DEFAULT_WAVEFORMS
+    selected = table[0]
+    for waveforms in table:
+        if waveforms.min_temperature is None or temperature >= waveforms.min_temperature:
+            selected = waveforms
+    return selected
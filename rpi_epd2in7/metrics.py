@@ -0,0 +1,122 @@
+""" metrics.py - timing and counters for display updates """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import threading
+import time
+
+# Monotonic, high resolution clock for measuring phases
+clock = time.perf_counter
+
+PHASES = ('convert', 'pack', 'spi', 'delay', 'busy_wait')
+""" Phases of a display update that are timed:
+'convert' - converting (and cropping) the image to 1-bit
+'pack' - packing the 1-bit image into a frame buffer
+'spi' - sending commands and data over SPI
+'delay' - fixed sleeps between commands (delay_ms)
+'busy_wait' - waiting for the display to finish refreshing """
+
+COUNTERS = ('spi_bytes', 'spi_transfers', 'lut_uploads', 'fast_lut_uploads',
+            'full_refreshes', 'partial_refreshes', 'fast_refreshes', 'busy_fallbacks')
+""" Counters kept alongside the phase timings """
+
+_COUNTER_HELP = {
+    'spi_bytes': 'Bytes sent to the display over SPI',
+    'spi_transfers': 'SPI transfers',
+    'lut_uploads': 'Lookup table sets uploaded to the display',
+    'fast_lut_uploads': 'Fast refresh lookup table sets uploaded to the display',
+    'full_refreshes': 'Full screen refreshes',
+    'partial_refreshes': 'Partial refreshes, including fast ones',
+    'fast_refreshes': 'Partial refreshes done with the fast lookup tables',
+    'busy_fallbacks': 'Busy waits that timed out and were ended by a status request',
+}
+
+
+class Metrics(object):
+    """ Collects per-phase timing and counters from an EPD object.
+
+    Usage:
+        metrics = Metrics()
+        epd.metrics = metrics
+        epd.smart_update(image)
+        metrics.snapshot()    # dict of timings and counters
+        metrics.prometheus()  # the same, in Prometheus text format
+
+    When EPD.metrics is None (the default), nothing is measured. """
+
+    def __init__(self, callback=None):
+        """ `callback`, if given, is called as callback(name, value) every time
+        a phase is timed (value in seconds) or a counter is incremented """
+        self.callback = callback
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """ Reset all timings and counters to zero """
+        with self._lock:
+            self.seconds = dict((phase, 0.0) for phase in PHASES)
+            """ total seconds spent in every phase """
+            self.calls = dict((phase, 0) for phase in PHASES)
+            """ number of times every phase was timed """
+            self.counters = dict((counter, 0) for counter in COUNTERS)
+            """ counter values, see COUNTERS """
+
+    def record(self, phase, seconds):
+        """ Add `seconds` to the time spent in `phase` """
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.calls[phase] += 1
+        if self.callback is not None:
+            self.callback(phase, seconds)
+
+    def increment(self, counter, value=1):
+        """ Add `value` to `counter` """
+        with self._lock:
+            self.counters[counter] += value
+        if self.callback is not None:
+            self.callback(counter, value)
+
+    def snapshot(self):
+        """ Get a consistent copy of all timings and counters as a dict """
+        with self._lock:
+            return {'seconds': dict(self.seconds),
+                    'calls': dict(self.calls),
+                    'counters': dict(self.counters)}
+
+    def prometheus(self, prefix='epd'):
+        """ Export all timings and counters in the Prometheus text exposition format """
+        snapshot = self.snapshot()
+        lines = ['# HELP {0}_phase_seconds_total Time spent in each phase of display updates'.format(prefix),
+                 '# TYPE {0}_phase_seconds_total counter'.format(prefix)]
+        for phase in PHASES:
+            lines.append('{0}_phase_seconds_total{{phase="{1}"}} {2!r}'.format(
+                prefix, phase, snapshot['seconds'][phase]))
+        lines.append('# HELP {0}_phase_calls_total Number of times each phase was timed'.format(prefix))
+        lines.append('# TYPE {0}_phase_calls_total counter'.format(prefix))
+        for phase in PHASES:
+            lines.append('{0}_phase_calls_total{{phase="{1}"}} {2}'.format(
+                prefix, phase, snapshot['calls'][phase]))
+        for counter in COUNTERS:
+            name = '{0}_{1}_total'.format(prefix, counter)
+            lines.append('# HELP {0} {1}'.format(name, _COUNTER_HELP[counter]))
+            lines.append('# TYPE {0} counter'.format(name))
+            lines.append('{0} {1}'.format(name, snapshot['counters'][counter]))
+        return '\n'.join(lines) + '\n'
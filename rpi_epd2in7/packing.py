@@ -0,0 +1,200 @@
+""" packing.py - convert 1-bit images into the controller's frame buffer layout """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The controller expects one bit per pixel, rows laid out one after the other,
+# with the leftmost pixel of every byte in the most significant bit.
+# A set bit is a white pixel, a cleared bit is a black one.
+# This happens to be exactly how Pillow stores mode '1' images internally,
+# as long as the row width is a multiple of 8 (otherwise Pillow pads every row
+# to a full byte, and the controller doesn't).
+
+
+def pack_image(image_monocolor):
+    """ Pack a mode '1' PIL Image object into a bytearray frame buffer.
+
+    This is the fast replacement for walking the image pixel by pixel. """
+    if image_monocolor.mode != '1':
+        image_monocolor = image_monocolor.convert('1')
+    width, height = image_monocolor.size
+    if width % 8 == 0:
+        # Pillow's own row layout matches the controller's, no need to touch pixels
+        return bytearray(image_monocolor.tobytes())
+    if numpy is not None:
+        return _pack_numpy(image_monocolor)
+    return _pack_python(image_monocolor)
+
+
+def _pack_numpy(image_monocolor):
+    """ Pack an image with an arbitrary width, using numpy """
+    pixels = numpy.asarray(image_monocolor.convert('L'), dtype=numpy.uint8).ravel()
+    return bytearray(numpy.packbits(pixels != 0).tobytes())
+
+
+def _pack_python(image_monocolor):
+    """ Pack an image with an arbitrary width, without any help """
+    width, height = image_monocolor.size
+    buf = bytearray((width * height + 7) // 8)
+    pixels = image_monocolor.load()
+    for y in range(height):
+        for x in range(width):
+            if pixels[x, y] != 0:
+                buf[(x + y * width) // 8] |= (0x80 >> ((x + y * width) % 8))
+    return buf
+
+
+def xor_buffers(a, b):
+    """ XOR two packed frame buffers of the same size.
+    The result has a set bit for every pixel that differs between them """
+    if len(a) != len(b):
+        raise ValueError('Buffers must be the same size')
+    if numpy is not None:
+        # Compare 8 bytes at a time when the length allows it
+        dtype = numpy.uint64 if len(a) % 8 == 0 else numpy.uint8
+        result = numpy.bitwise_xor(numpy.frombuffer(a, dtype=dtype),
+                                   numpy.frombuffer(b, dtype=dtype))
+        return bytearray(result.tobytes())
+    # Python's big integers do the XOR a machine word at a time
+    result = int.from_bytes(bytes(a), 'big') ^ int.from_bytes(bytes(b), 'big')
+    return bytearray(result.to_bytes(len(a), 'big'))
+
+
+def whitened_pixels(old, new):
+    """ Get a packed buffer with a set bit for every pixel that is black in
+    `old` and white in `new`, two packed frame buffers of the same size """
+    if len(old) != len(new):
+        raise ValueError('Buffers must be the same size')
+    if numpy is not None:
+        dtype = numpy.uint64 if len(old) % 8 == 0 else numpy.uint8
+        result = numpy.bitwise_and(numpy.invert(numpy.frombuffer(old, dtype=dtype)),
+                                   numpy.frombuffer(new, dtype=dtype))
+        return bytearray(result.tobytes())
+    result = int.from_bytes(bytes(new), 'big') & ~int.from_bytes(bytes(old), 'big')
+    return bytearray(result.to_bytes(len(old), 'big'))
+
+
+def is_blank(buf):
+    """ Check if a packed buffer has no set bits, like a difference buffer of identical frames """
+    return not bytes(buf).strip(b'\x00')
+
+
+def crop_buffer(buf, width, region):
+    """ Get the packed data of `region` out of a packed frame buffer `width` pixels wide.
+
+    `region` is a (x0, y0, x1, y1) box with x0 and x1 being multiples of 8.
+    Regions spanning the entire width are returned as a memoryview into `buf`
+    without copying anything. """
+    x0, y0, x1, y1 = region
+    stride = width // 8
+    view = memoryview(buf)
+    if x0 == 0 and x1 == width:
+        return view[y0 * stride:y1 * stride]
+    start = x0 // 8
+    end = x1 // 8
+    return b''.join(view[y * stride + start:y * stride + end] for y in range(y0, y1))
+
+
+def paste_buffer(buf, width, region, data):
+    """ Write the packed data of `region` into a packed frame buffer `width` pixels wide """
+    x0, y0, x1, y1 = region
+    stride = width // 8
+    row_size = (x1 - x0) // 8
+    if x0 == 0 and x1 == width:
+        buf[y0 * stride:y1 * stride] = data
+        return
+    data = memoryview(data)
+    for row, y in enumerate(range(y0, y1)):
+        offset = y * stride + x0 // 8
+        buf[offset:offset + row_size] = data[row * row_size:(row + 1) * row_size]
+
+
+# Every byte with its bits in reverse order, for mirroring rows
+_REVERSED_BITS = bytes(bytearray(int('{0:08b}'.format(i)[::-1], 2) for i in range(256)))
+
+
+def _transpose8(rows):
+    """ Transpose an 8x8 pixel block, given as 8 row bytes, into 8 column bytes """
+    # Hacker's Delight, 7-3: swap 1x1, 2x2 and then 4x4 bit blocks across the diagonal
+    x = int.from_bytes(bytes(rows), 'big')
+    t = (x ^ (x >> 7)) & 0x00AA00AA00AA00AA
+    x = x ^ t ^ (t << 7)
+    t = (x ^ (x >> 14)) & 0x0000CCCC0000CCCC
+    x = x ^ t ^ (t << 14)
+    t = (x ^ (x >> 28)) & 0x00000000F0F0F0F0
+    x = x ^ t ^ (t << 28)
+    return x.to_bytes(8, 'big')
+
+
+def _transpose_python(buf, width, height):
+    """ Transpose a packed buffer, one 8x8 block at a time """
+    stride = width // 8
+    out_stride = height // 8
+    out = bytearray(len(buf))
+    for block_row in range(height // 8):
+        for column in range(stride):
+            rows = buf[block_row * 8 * stride + column::stride][:8]
+            columns = _transpose8(rows)
+            # Column i of the block becomes row (column * 8 + i) of the result
+            for i in range(8):
+                out[(column * 8 + i) * out_stride + block_row] = columns[i]
+    return out
+
+
+def _flip_rows(buf, width, height):
+    """ Mirror a packed buffer top to bottom """
+    stride = width // 8
+    return bytearray(b''.join(bytes(buf[y * stride:(y + 1) * stride]) for y in reversed(range(height))))
+
+
+def _mirror_rows(buf, width, height):
+    """ Mirror a packed buffer left to right """
+    stride = width // 8
+    return bytearray(b''.join(bytes(buf[y * stride:(y + 1) * stride])[::-1].translate(_REVERSED_BITS)
+                              for y in range(height)))
+
+
+def rotate_buffer(buf, width, height, rotation):
+    """ Rotate a packed `width`x`height` frame buffer counter-clockwise by
+    `rotation` degrees (0, 90, 180 or 270), like PIL's rotate(rotation, expand=True).
+
+    `width` must be a multiple of 8, and so must `height` for 90 and 270 degrees. """
+    if rotation == 0:
+        return buf
+    if width % 8 or (rotation != 180 and height % 8):
+        raise ValueError('Can only rotate buffers with dimensions that are multiples of 8')
+    if rotation == 180:
+        # Reversing the whole buffer reverses the order of rows and of bytes,
+        # what's left is reversing the bits of every byte
+        return bytearray(bytes(buf)[::-1].translate(_REVERSED_BITS))
+    if rotation not in (90, 270):
+        raise ValueError('Rotation must be 0, 90, 180 or 270, got {0}'.format(rotation))
+    if numpy is not None:
+        pixels = numpy.unpackbits(numpy.frombuffer(bytes(buf), dtype=numpy.uint8)).reshape(height, width)
+        return bytearray(numpy.packbits(numpy.rot90(pixels, rotation // 90)).tobytes())
+    transposed = _transpose_python(buf, width, height)
+    if rotation == 90:
+        return _flip_rows(transposed, height, width)
+    return _mirror_rows(transposed, height, width)
@@ -0,0 +1,124 @@
+""" panels.py - drive several displays from one process """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import threading
+
+# Every display gets a thread for the duration of a call, so while one
+# display waits for its busy pin, the others can be sent their frames.
+# Displays on the same SPI bus share one EPD.bus_lock, so only one of them
+# talks at a time; the waits, which are most of a refresh, all overlap.
+# Updating N displays takes about one refresh plus N times the transfers.
+
+
+class PanelManager(object):
+    """ Updates several displays at once, each connected to its own pins
+    and SPI chip select.
+
+    Usage:
+        manager = PanelManager([
+            EPD(),
+            EPD(pins=Pins(rst=5, dc=6, cs=7, busy=13), backend=HardwareBackend(bus=0, device=1)),
+        ])
+        manager.init()
+        manager.smart_update([image1, image2])
+    """
+
+    def __init__(self, panels):
+        """ `panels` - the EPD objects to manage. Don't use them directly while calls
+        to the manager are in progress """
+        self.panels = list(panels)
+        """ the EPD objects, in the order images are passed in """
+        self.errors = []
+        """ (panel index, exception) pairs of the panels that failed in the last call """
+        locks = {}
+        for panel in self.panels:
+            # Simulated backends have no bus, they're treated as all on the same one
+            bus = getattr(panel.backend, 'bus', None)
+            panel.bus_lock = locks.setdefault(bus, threading.RLock())
+
+    def __len__(self):
+        return len(self.panels)
+
+    def map(self, function, items=None):
+        """ Call `function(panel, item)` for every panel and its item of `items`
+        (or `function(panel)` if `items` is None) in parallel, skipping panels
+        whose item is None. Returns the results in panel order, None for skipped panels.
+        If calls failed, raises the exception of the first one once all of them are done,
+        see `errors` """
+        if items is None:
+            calls = [(function, (panel,)) for panel in self.panels]
+        else:
+            items = list(items)
+            if len(items) != len(self.panels):
+                raise ValueError('Got {0} items for {1} panels'.format(len(items), len(self.panels)))
+            calls = [(function, (panel, item)) if item is not None else None
+                     for panel, item in zip(self.panels, items)]
+        results = [None] * len(calls)
+        errors = []
+
+        def run(index, call):
+            try:
+                results[index] = call[0](*call[1])
+            except Exception as e:
+                errors.append((index, e))
+
+        threads = []
+        for index, call in enumerate(calls):
+            if call is None:
+                continue
+            thread = threading.Thread(target=run, args=(index, call),
+                                      name='epd-panel-{0}'.format(index))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+        for thread in threads:
+            thread.join()
+        self.errors = sorted(errors, key=lambda error: error[0])
+        if self.errors:
+            raise self.errors[0][1]
+        return results
+
+    def init(self):
+        """ Initialize all displays """
+        self.map(lambda panel: panel.init())
+
+    def wake(self):
+        """ Wake all displays up after sleep() """
+        self.map(lambda panel: panel.wake())
+
+    def sleep(self):
+        """ Put all displays into deep sleep """
+        self.map(lambda panel: panel.sleep())
+
+    def smart_update(self, images):
+        """ Show `images`, one per panel, with EPD.smart_update().
+        Panels whose image is None are left alone """
+        self.map(lambda panel, image: panel.smart_update(image), images)
+
+    def display_frame(self, images):
+        """ Show `images`, one per panel, with a full refresh.
+        Panels whose image is None are left alone """
+        self.map(lambda panel, image: panel.display_frame(image), images)
+
+    def clean(self):
+        """ EPD.clean() all displays. Returns True if any of them was refreshed """
+        return any(self.map(lambda panel: panel.clean()))
@@ -0,0 +1,230 @@
+""" power.py - sleep and clean up the display while nobody is looking """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import contextlib
+import threading
+import time
+
+# The slowest thing an update can run into is a full refresh forced by the
+# partial refresh limit. A display that's updated now and then is idle most
+# of the time, so PowerManager does the cleaning up while it's idle, and does
+# full refreshes early, before an update would be forced to do one.
+# After a longer while it puts the controller into deep sleep, and the next
+# update wakes it up again (EPD does that by itself).
+
+CLEAN_AFTER = 10
+""" Default seconds without updates before cleaning up the display """
+
+SLEEP_AFTER = 60
+""" Default seconds without updates before putting the display into deep sleep """
+
+FLUSH_AT = 0.5
+""" Default part of EPD.partial_refresh_limit after which idle time is used for a full refresh """
+
+
+class PowerManager(object):
+    """ Cleans up after partial refreshes and puts the display to sleep when it's idle.
+
+    Update the display through the manager, so it knows when the display
+    is in use. Updates wait for the clean up or sleep in progress, if any.
+
+    Usage:
+        manager = PowerManager(epd)
+        manager.start()
+        manager.smart_update(image)
+        with manager.activity():
+            canvas.update()  # anything else that uses the display
+        ...
+        manager.stop()
+    """
+
+    def __init__(self, epd, clean_after=CLEAN_AFTER, sleep_after=SLEEP_AFTER, flush_at=FLUSH_AT):
+        """ `clean_after` - seconds without updates before cleaning up, None to never clean up
+        `sleep_after` - seconds without updates before going to deep sleep, None to never sleep
+        `flush_at` - do a full refresh while idle once an area took this part of
+                     `partial_refresh_limit` partial refreshes, 1 to wait until it's due """
+        self.epd = epd
+        """ The EPD object to manage. Don't update it directly while the manager runs """
+        self.clean_after = clean_after
+        """ seconds without updates before cleaning up the display, None to never clean up """
+        if clean_after is not None:
+            epd.defer_cleaning = True
+        self.sleep_after = sleep_after
+        """ seconds without updates before putting the display into deep sleep, None to never sleep """
+        self.flush_at = flush_at
+        """ part of `partial_refresh_limit` after which idle time is used for a full refresh """
+        self.cleanups = 0
+        """ number of times areas were refreshed with the normal LUT while idle """
+        self.flushes = 0
+        """ number of full refreshes done while idle """
+        self.sleeps = 0
+        """ number of times the display was put into deep sleep """
+        self.wakeups = 0
+        """ number of updates that had to wake the display up (or initialize it) """
+
+        self._lock = threading.RLock()  # held while using the display
+        self._condition = threading.Condition()
+        self._last_activity = time.time()
+        self._needs_cleaning = False
+        self._running = False
+        self._error = None
+        self._thread = None
+
+    def start(self):
+        """ Start the background thread """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            self._last_activity = time.time()
+        self._thread = threading.Thread(target=self._run, name='epd-power')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, sleep=False):
+        """ Stop the background thread. If `sleep` is True, put the display into deep sleep """
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        if sleep and self.epd._init_performed:
+            with self._lock:
+                self.epd.sleep()
+            self.sleeps += 1
+
+    @contextlib.contextmanager
+    def activity(self):
+        """ Context manager for using the display directly, keeping the manager off of it """
+        with self._lock:
+            with self._condition:
+                self._raise_error()
+            if not self.epd._init_performed:
+                self.wakeups += 1
+            try:
+                yield self.epd
+            finally:
+                with self._condition:
+                    self._last_activity = time.time()
+                    self._needs_cleaning = True
+                    self._condition.notify_all()
+
+    def smart_update(self, image):
+        """ EPD.smart_update() """
+        with self.activity():
+            self.epd.smart_update(image)
+
+    def display_frame(self, image):
+        """ EPD.display_frame() """
+        with self.activity():
+            self.epd.display_frame(image)
+
+    def display_partial_frame(self, image, x, y, h, w, fast=False):
+        """ EPD.display_partial_frame() """
+        with self.activity():
+            self.epd.display_partial_frame(image, x, y, h, w, fast)
+
+    def smart_update_buffer(self, data, box=None):
+        """ EPD.smart_update_buffer() """
+        with self.activity():
+            self.epd.smart_update_buffer(data, box)
+
+    def display_buffer(self, data, box=None):
+        """ EPD.display_buffer() """
+        with self.activity():
+            self.epd.display_buffer(data, box)
+
+    def sleeping(self):
+        """ Check if the display is in deep sleep (or wasn't initialized yet) """
+        return not self.epd._init_performed
+
+    def stats(self):
+        """ Get the manager's counters as a dict """
+        with self._condition:
+            return {'cleanups': self.cleanups,
+                    'flushes': self.flushes,
+                    'sleeps': self.sleeps,
+                    'wakeups': self.wakeups}
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _next_action(self):
+        """ Get the next thing to do while idle and when, as (action, time), or (None, None) """
+        last = self._last_activity
+        sleep_at = last + self.sleep_after if self.sleep_after is not None else None
+        if self._needs_cleaning and self.clean_after is not None:
+            # Cleaning up after going to sleep would wake the display up again
+            clean_at = last + self.clean_after
+            if sleep_at is not None:
+                clean_at = min(clean_at, sleep_at)
+            return 'clean', clean_at
+        if sleep_at is not None and self.epd._init_performed:
+            return 'sleep', sleep_at
+        return None, None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                action, due = self._next_action()
+                if action is None:
+                    self._condition.wait()
+                    continue
+                if due > time.time():
+                    self._condition.wait(due - time.time())
+                    continue
+                last_activity = self._last_activity
+            with self._lock:
+                with self._condition:
+                    if self._last_activity != last_activity or not self._running:
+                        continue  # the display was used in the meantime
+                try:
+                    if action == 'clean':
+                        self._clean()
+                    else:
+                        self.epd.sleep()
+                        self.sleeps += 1
+                except Exception as e:
+                    with self._condition:
+                        self._error = e
+                with self._condition:
+                    if action == 'clean':
+                        self._needs_cleaning = False
+
+    def _clean(self):
+        epd = self.epd
+        if epd._shadow is None:
+            return
+        limit = epd.partial_refresh_limit
+        if (limit is not None and self.flush_at is not None and
+                epd.ghosting.needs_full_refresh(max(int(limit * self.flush_at), 1))):
+            # Better now than in the middle of the next update
+            epd._display_frame_buffer(epd._shadow)
+            self.flushes += 1
+        elif epd.clean():
+            self.cleanups += 1
@@ -0,0 +1,189 @@
+""" regions.py - find the areas of the screen that need to be refreshed """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+# Regions are (x0, y0, x1, y1) boxes, like the ones returned by PIL's getbbox(),
+# except x0 and x1 are always multiples of 8, as required by the controller
+# for partial refreshes.
+
+REGION_OVERHEAD = 1024
+""" The most an additional partial refresh is worth, in bytes of frame data.
+Merging two regions also drives every unchanged pixel between them through
+the waveform, which wears the panel and adds to the ghosting of areas that
+didn't change, so it's not worth re-driving much more than this to save a
+refresh, however long the waveform is. See refresh_overhead() """
+
+MAX_REGIONS = 4
+""" Maximum number of separate regions to refresh in a single update """
+
+
+def refresh_overhead(duration, spi_speed_hz):
+    """ The cost of an additional partial refresh playing a `duration` seconds long
+    waveform, in bytes: what could be sent at `spi_speed_hz` in that time, up to
+    REGION_OVERHEAD. Two regions are only worth refreshing separately if merging
+    them would send more """
+    return min(int(duration * spi_speed_hz / 8), REGION_OVERHEAD)
+
+
+def region_cost(region):
+    """ Bytes sent over the wire to refresh `region` (old data + new data) """
+    x0, y0, x1, y1 = region
+    return 2 * ((x1 - x0) // 8) * (y1 - y0)
+
+
+def _union(a, b):
+    return (min(a[0], b[0]), min(a[1], b[1]), max(a[2], b[2]), max(a[3], b[3]))
+
+
+def _merge_cost(a, b):
+    """ Additional bytes sent by refreshing the union of `a` and `b` instead of both """
+    return region_cost(_union(a, b)) - region_cost(a) - region_cost(b)
+
+
+def _overlap(a, b):
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def _scan_rows(diff, width, height):
+    """ Build one region for every run of consecutive changed rows """
+    stride = width // 8
+    clean_row = bytes(bytearray(stride))
+    regions = []
+    current = None
+    for y in range(height):
+        row = bytes(diff[y * stride:(y + 1) * stride])
+        if row == clean_row:
+            if current is not None:
+                regions.append(tuple(current))
+                current = None
+            continue
+        first = stride - len(row.lstrip(b'\x00'))
+        last = len(row.rstrip(b'\x00'))
+        if current is None:
+            current = [first * 8, y, last * 8, y + 1]
+        else:
+            current[0] = min(current[0], first * 8)
+            current[2] = max(current[2], last * 8)
+            current[3] = y + 1
+    if current is not None:
+        regions.append(tuple(current))
+    return regions
+
+
+def _merge_regions(regions, overhead, max_regions):
+    """ Greedily merge regions while merging is cheaper than refreshing separately """
+    regions = list(regions)
+    while len(regions) > 1:
+        best = None
+        for i in range(len(regions)):
+            for j in range(i + 1, len(regions)):
+                cost = _merge_cost(regions[i], regions[j])
+                if best is None or cost < best[0]:
+                    best = (cost, i, j)
+        cost, i, j = best
+        needs_merge = len(regions) > max_regions or cost <= overhead
+        if not needs_merge:
+            # Overlapping regions would have their pixels driven twice
+            overlapping = [(i, j) for i in range(len(regions))
+                           for j in range(i + 1, len(regions))
+                           if _overlap(regions[i], regions[j])]
+            if not overlapping:
+                break
+            i, j = overlapping[0]
+        merged = _union(regions[i], regions[j])
+        del regions[j]
+        regions[i] = merged
+    return regions
+
+
+def align_region(box, width, height):
+    """ Turn a (x0, y0, x1, y1) box into a region, rounding x0 and x1 out to
+    multiples of 8 and clipping it to a `width`x`height` screen.
+    Returns None if nothing is left of the box """
+    x0, y0, x1, y1 = box
+    x0 = max(int(x0) // 8 * 8, 0)
+    x1 = min((int(x1) + 7) // 8 * 8, width)
+    y0 = max(int(y0), 0)
+    y1 = min(int(y1), height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def rotate_box(box, width, height, rotation):
+    """ Map a (x0, y0, x1, y1) box in a `width`x`height` image to the same
+    pixels in the image rotated counter-clockwise by `rotation` degrees
+    (0, 90, 180 or 270), like PIL's rotate(rotation, expand=True) does """
+    x0, y0, x1, y1 = box
+    if rotation == 90:
+        return (y0, width - x1, y1, width - x0)
+    if rotation == 180:
+        return (width - x1, height - y1, width - x0, height - y0)
+    if rotation == 270:
+        return (height - y1, x0, height - y0, x1)
+    return (x0, y0, x1, y1)
+
+
+def merge_regions(regions, overhead=REGION_OVERHEAD, max_regions=MAX_REGIONS):
+    """ Merge regions that are cheaper to refresh together, or overlap,
+    leaving at most `max_regions` of them, sorted top to bottom """
+    return sorted(_merge_regions(regions, overhead, max(max_regions, 1)), key=lambda r: (r[1], r[0]))
+
+
+def absorb_regions(regions, others, margin=(0, 0), overhead=REGION_OVERHEAD, max_regions=MAX_REGIONS):
+    """ Merge the regions of `others` that overlap one of `regions`, or are within
+    `margin`, a (x, y) distance in pixels, of it, into `regions`.
+    Returns the merged `regions` and the rest of `others` """
+    mx, my = margin
+    grown = [(x0 - mx, y0 - my, x1 + mx, y1 + my) for x0, y0, x1, y1 in regions]
+    absorbed = list(regions)
+    rest = []
+    for other in others:
+        near = [i for i, region in enumerate(grown) if _overlap(region, other)]
+        if near:
+            absorbed[near[0]] = _union(absorbed[near[0]], other)
+        else:
+            rest.append(other)
+    if len(rest) == len(others):
+        return list(regions), rest
+    return merge_regions(absorbed, overhead, max_regions), rest
+
+
+def find_dirty_regions(diff, width, height, overhead=REGION_OVERHEAD, max_regions=MAX_REGIONS):
+    """ Split a packed difference buffer into regions that need to be refreshed.
+
+    `diff` is a packed frame buffer where every set bit marks a changed pixel,
+    `width` and `height` are its dimensions in pixels (`width` must be a multiple of 8).
+    Returns a list of (x0, y0, x1, y1) regions, sorted top to bottom, which is
+    empty if nothing changed. """
+    regions = _scan_rows(diff, width, height)
+    if not regions:
+        return []
+    # Adjacent row runs are usually parts of the same thing (a line of text,
+    # separated by the gap between letters), so merge those in a single
+    # linear pass before doing the more expensive pairwise merging.
+    bands = [regions[0]]
+    for region in regions[1:]:
+        if _merge_cost(bands[-1], region) <= overhead:
+            bands[-1] = _union(bands[-1], region)
+        else:
+            bands.append(region)
+    return merge_regions(bands, overhead, max_regions)
@@ -0,0 +1,234 @@
+""" scheduler.py - display frames in the background, dropping stale ones """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import threading
+
+
+class UpdateScheduler(object):
+    """ Display frames with smart_update() from a background thread.
+
+    Frames can be submitted at any rate. Only the newest frame waiting to be
+    displayed is kept, older ones are dropped (coalesced) when a new frame
+    arrives. Since smart_update() diffs against what the panel actually shows,
+    the changes of dropped frames are still included in the next refresh.
+    A submitted frame is displayed at most one refresh after the one in progress.
+
+    If `clean_after` is set, EPD.clean() is called once no frames were
+    submitted for that many seconds, and smart_update() is told to leave
+    the cleaning to it (see EPD.defer_cleaning).
+
+    If `pipelined` is True, submit() doesn't do any work: a second thread
+    converts and packs the newest frame, and finds out what changed from the
+    frame being displayed, all while the display refreshes. Once the refresh
+    is done, the prepared frame is sent right away. Don't modify an image
+    after passing it to submit() in this mode.
+
+    Usage:
+        scheduler = UpdateScheduler(epd)
+        scheduler.start()
+        scheduler.submit(image)  # returns immediately
+        ...
+        scheduler.stop()
+    """
+
+    def __init__(self, epd, clean_after=None, pipelined=False):
+        self.epd = epd
+        """ The EPD object frames are displayed on. Don't use it directly while the scheduler runs """
+        self.clean_after = clean_after
+        """ seconds without new frames before cleaning up the display, None to never clean up """
+        if clean_after is not None:
+            epd.defer_cleaning = True
+        self.pipelined = pipelined
+        """ prepare frames in a second thread, see the class documentation """
+        self.submitted = 0
+        """ number of frames passed to submit() """
+        self.displayed = 0
+        """ number of frames sent to the display """
+        self.coalesced = 0
+        """ number of frames dropped because a newer frame replaced them """
+        self.cleanups = 0
+        """ number of times the display was cleaned up (refreshed) while idle """
+
+        self._pending = None  # (frame buffer, frame it was compared to, changed regions)
+        self._incoming = None  # image waiting to be prepared, when pipelined
+        self._preparing = False
+        self._front = None  # the last frame buffer handed to the display
+        self._busy = False
+        self._needs_cleaning = False
+        self._running = False
+        self._error = None
+        self._thread = None
+        self._prepare_thread = None
+        self._condition = threading.Condition()
+
+    def start(self):
+        """ Start the background thread """
+        with self._condition:
+            if self._running:
+                return
+            self._running = True
+            # A copy, the display updates its shadow buffer in place
+            shadow = self.epd._shadow
+            self._front = bytearray(shadow) if shadow is not None else None
+        self._thread = threading.Thread(target=self._run, name='epd-scheduler')
+        self._thread.daemon = True
+        self._thread.start()
+        if self.pipelined:
+            self._prepare_thread = threading.Thread(target=self._prepare, name='epd-prepare')
+            self._prepare_thread.daemon = True
+            self._prepare_thread.start()
+
+    def submit(self, image):
+        """ Queue `image` to be displayed, replacing any frame still waiting.
+        Unless `pipelined` is set, the image is packed right away, so it's
+        safe to modify it after this returns """
+        if self.pipelined:
+            with self._condition:
+                self._raise_error()
+                if self._incoming is not None:
+                    self.coalesced += 1
+                self._incoming = image
+                self.submitted += 1
+                self._condition.notify_all()
+            return
+        frame_buffer = self.epd._get_frame_buffer(image)
+        with self._condition:
+            self._raise_error()
+            if self._pending is not None:
+                self.coalesced += 1
+            self._pending = (frame_buffer, None, None)
+            self.submitted += 1
+            self._condition.notify_all()
+
+    def flush(self, timeout=None):
+        """ Wait until all submitted frames are displayed.
+        Returns False if `timeout` (in seconds) expired first """
+        with self._condition:
+            done = self._condition.wait_for(lambda: self._idle() or self._error is not None, timeout)
+            self._raise_error()
+            return done
+
+    def stop(self, flush=True):
+        """ Stop the background thread.
+        If `flush` is True, frames still waiting are displayed first, and an error
+        displaying them is raised once the threads are stopped """
+        try:
+            if flush and self._running:
+                self.flush()
+        finally:
+            with self._condition:
+                self._running = False
+                self._pending = None
+                self._incoming = None
+                self._condition.notify_all()
+            if self._thread is not None:
+                self._thread.join()
+                self._thread = None
+            if self._prepare_thread is not None:
+                self._prepare_thread.join()
+                self._prepare_thread = None
+
+    def stats(self):
+        """ Get the scheduler's counters as a dict """
+        with self._condition:
+            return {'submitted': self.submitted,
+                    'displayed': self.displayed,
+                    'coalesced': self.coalesced,
+                    'cleanups': self.cleanups,
+                    'pending': int(self._pending is not None) + int(self._incoming is not None)}
+
+    def _idle(self):
+        return (self._pending is None and self._incoming is None and
+                not self._preparing and not self._busy)
+
+    def _raise_error(self):
+        if self._error is not None:
+            error = self._error
+            self._error = None
+            raise error
+
+    def _run(self):
+        while True:
+            with self._condition:
+                timeout = self.clean_after if self._needs_cleaning else None
+                self._condition.wait_for(lambda: self._pending is not None or not self._running, timeout)
+                if not self._running:
+                    return
+                pending = self._pending
+                self._pending = None
+                frame_buffer = None
+                if pending is not None:
+                    frame_buffer, base, regions = pending
+                    self._front = frame_buffer
+                self._busy = True
+            error = None
+            cleaned = False
+            try:
+                if frame_buffer is None:
+                    # Nothing was submitted for a while, the display is all ours
+                    cleaned = self.epd.clean()
+                else:
+                    if base is None or base != self.epd._shadow:
+                        # Compared to something else than what's on the display
+                        regions = None
+                    self.epd._smart_update_buffer(frame_buffer, regions)
+            except Exception as e:
+                error = e
+            with self._condition:
+                if error is not None:
+                    self._error = error
+                elif frame_buffer is not None:
+                    self.displayed += 1
+                elif cleaned:
+                    self.cleanups += 1
+                self._needs_cleaning = frame_buffer is not None and self.clean_after is not None
+                self._busy = False
+                self._condition.notify_all()
+
+    def _prepare(self):
+        """ Convert, pack and diff submitted images while the display is busy """
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: self._incoming is not None or not self._running)
+                if not self._running:
+                    return
+                image = self._incoming
+                self._incoming = None
+                # A frame still waiting is replaced by this one, so this one
+                # is displayed right after the frame the display got last
+                base = self._front
+                self._preparing = True
+            error = None
+            try:
+                frame_buffer = self.epd._get_frame_buffer(image)
+                regions = self.epd._changed_regions(base, frame_buffer) if base is not None else None
+            except Exception as e:
+                error = e
+            with self._condition:
+                if error is not None:
+                    self._error = error
+                else:
+                    if self._pending is not None:
+                        self.coalesced += 1
+                    self._pending = (frame_buffer, base, regions)
+                self._preparing = False
+                self._condition.notify_all()
@@ -0,0 +1,371 @@
+""" simulator.py - a simulated panel, for running the library without hardware """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import collections
+import random
+import threading
+import time
+
+from . import epd
+from .backend import Backend, LOW, HIGH
+from .lut import LUT_BLOBS, QUICK_LUT_BLOBS, PLL_FRAME_RATES, DEFAULT_FRAME_RATE, waveform_frames
+from .packing import crop_buffer, paste_buffer
+
+# The simulator decodes the command stream EPD sends into the controller's
+# two frame RAMs, and copies them to what the panel "shows" when a refresh
+# command arrives. Time is simulated too: SPI transfers take as long as they
+# would at the configured clock speed, and the busy pin stays low for as long
+# as the uploaded LUT waveforms take to play.
+#
+# By default the clock is virtual, so waiting for a refresh takes no time at
+# all, which is what benchmarks and tests want. Pass realtime=True to actually
+# sleep instead.
+
+SPI_TRANSFER_OVERHEAD = 0.00003
+""" Fixed cost of a single SPI transfer (ioctl, chip select), in seconds """
+
+POWER_ON_TIME = 0.08
+""" How long the busy pin stays low after POWER_ON, in seconds """
+
+Refresh = collections.namedtuple('Refresh', ['kind', 'region', 'lut', 'start', 'duration'])
+""" A refresh the simulated panel performed.
+`kind` is 'full' or 'partial', `region` is a (x0, y0, x1, y1) box,
+`lut` is 'normal', 'quick' or 'custom' depending on the uploaded LUTs,
+`start` and `duration` are in seconds of simulated time """
+
+_LUT_COMMANDS = (epd.LUT_FOR_VCOM, epd.LUT_WHITE_TO_WHITE, epd.LUT_BLACK_TO_WHITE,
+                 epd.LUT_WHITE_TO_BLACK, epd.LUT_BLACK_TO_BLACK)
+_PARTIAL_WINDOW_SIZE = 8
+
+
+class SimulatorError(RuntimeError):
+    """ Raised when the simulated panel receives something the real one can't handle """
+
+
+_KNOWN_LUTS = (('normal', dict(LUT_BLOBS)), ('quick', dict(QUICK_LUT_BLOBS)))
+
+
+def _parse_window(data):
+    """ Get the (x0, y0, x1, y1) region from partial refresh window parameters """
+    x = data[0] << 8 | data[1]
+    y = data[2] << 8 | data[3]
+    w = data[4] << 8 | data[5]
+    h = data[6] << 8 | data[7]
+    return (x, y, x + w, y + h)
+
+
+class SimulatedBackend(Backend):
+    """ A backend that simulates the panel instead of talking to hardware.
+
+    Use it like so:
+        panel = SimulatedBackend()
+        epd = EPD(backend=panel)
+        epd.smart_update(image)
+        panel.image()  # what the panel shows now
+        panel.stats()  # bytes sent, simulated time, refresh counts...
+    """
+
+    def __init__(self, width=epd.EPD_WIDTH, height=epd.EPD_HEIGHT, realtime=False,
+                 max_transfer_size=4096, frame_rate=None, temperature=20.0,
+                 max_spi_speed_hz=None):
+        """ `realtime` - sleep for real instead of using a virtual clock
+        `max_transfer_size` - largest SPI transfer, like the spidev bufsiz parameter
+        `frame_rate` - waveform frame rate in Hz, overriding the one set with PLL_CONTROL
+        `temperature` - what the temperature sensor reads, in degrees Celsius
+        `max_spi_speed_hz` - fastest SPI clock the wiring carries, None for no limit """
+        self.width = width
+        self.height = height
+        self.realtime = realtime
+        self.max_transfer_size = max_transfer_size
+        self.frame_rate = frame_rate
+        """ waveform frame rate in Hz, None to follow PLL_CONTROL """
+        self.spi_speed_hz = epd.SPI_SPEED_HZ
+        """ SPI clock speed, as set by setup() """
+        self.temperature = temperature
+        """ what the temperature sensor reads, in degrees Celsius, None if it can't be read """
+        self.max_spi_speed_hz = max_spi_speed_hz
+        """ fastest SPI clock the wiring carries, None for no limit.
+        Faster writes are lost, and faster reads return noise """
+
+        frame_size = width * height // 8
+        self.displayed = bytearray(b'\xff' * frame_size)
+        """ packed frame buffer of what the panel currently shows """
+        self.old_ram = bytearray(b'\xff' * frame_size)
+        """ the controller's "old data" frame RAM (DATA_START_TRANSMISSION_1) """
+        self.new_ram = bytearray(b'\xff' * frame_size)
+        """ the controller's "new data" frame RAM (DATA_START_TRANSMISSION_2) """
+        self.luts = {}
+        """ uploaded LUTs, by command """
+
+        self.pins = epd.DEFAULT_PINS
+        """ the epd.Pins the display is connected to, as passed to setup() """
+
+        self._pins = {}
+        self._command = None
+        self._data = bytearray()
+        self._pll_frame_rate = DEFAULT_FRAME_RATE
+        self._asleep = False
+        self._powered = False
+        self._busy_until = 0.0
+        self._watch = None
+        self._noise = random.Random(0)
+        self._epoch = time.time()
+        self._clock = 0.0
+        self.reset_stats()
+
+    def reset_stats(self):
+        """ Reset the counters returned by stats() and forget past refreshes """
+        self.bytes_sent = 0
+        """ total bytes sent over SPI, commands included """
+        self.data_bytes_sent = 0
+        """ bytes sent over SPI as command parameters or frame data """
+        self.commands = 0
+        """ number of commands sent """
+        self.transfers = 0
+        """ number of SPI transfers """
+        self.spi_time = 0.0
+        """ simulated seconds spent on SPI transfers """
+        self.busy_time = 0.0
+        """ simulated seconds the panel was busy for """
+        self.lut_uploads = 0
+        """ number of LUT tables uploaded """
+        self.commands_while_busy = 0
+        """ number of commands sent while the busy pin was low, these are likely bugs """
+        self.garbled_transfers = 0
+        """ number of SPI transfers faster than max_spi_speed_hz """
+        self.refreshes = []
+        """ list of Refresh tuples, oldest first """
+
+    def stats(self):
+        """ Get the simulator's counters as a dict """
+        return {'bytes_sent': self.bytes_sent,
+                'data_bytes_sent': self.data_bytes_sent,
+                'commands': self.commands,
+                'transfers': self.transfers,
+                'spi_time': self.spi_time,
+                'busy_time': self.busy_time,
+                'lut_uploads': self.lut_uploads,
+                'commands_while_busy': self.commands_while_busy,
+                'garbled_transfers': self.garbled_transfers,
+                'full_refreshes': sum(1 for r in self.refreshes if r.kind == 'full'),
+                'partial_refreshes': sum(1 for r in self.refreshes if r.kind == 'partial'),
+                'time': self.now()}
+
+    def image(self):
+        """ Get a mode '1' PIL Image object of what the panel currently shows """
+        from PIL import Image
+        return Image.frombytes('1', (self.width, self.height), bytes(self.displayed))
+
+    def now(self):
+        """ Current time on the simulator's clock, in seconds """
+        if self.realtime:
+            return time.time() - self._epoch
+        return self._clock
+
+    def _advance(self, seconds):
+        if seconds <= 0:
+            return
+        if self.realtime:
+            time.sleep(seconds)
+        else:
+            self._clock += seconds
+
+    def is_busy(self):
+        return self.now() < self._busy_until
+
+    # Backend interface
+
+    def setup(self, outputs, inputs, spi_speed_hz, spi_mode=0):
+        if spi_mode != 0:
+            raise SimulatorError('The controller only supports SPI mode 0')
+        # EPD passes the reset, data/command and chip select pins, then the busy pin
+        self.pins = epd.Pins(*(tuple(outputs) + tuple(inputs)))
+        self.spi_speed_hz = spi_speed_hz
+
+    def set_spi_speed(self, spi_speed_hz):
+        self.spi_speed_hz = spi_speed_hz
+
+    def _garbled(self):
+        """ Check if transfers at the current speed are corrupted """
+        return self.max_spi_speed_hz is not None and self.spi_speed_hz > self.max_spi_speed_hz
+
+    def write_pin(self, pin, value):
+        previous = self._pins.get(pin)
+        self._pins[pin] = value
+        if pin == self.pins.rst and value == HIGH and previous == LOW:
+            # A reset pulse wakes the controller up from deep sleep
+            self._reset()
+
+    def read_pin(self, pin):
+        if pin == self.pins.busy:
+            return LOW if self.is_busy() else HIGH
+        return self._pins.get(pin, LOW)
+
+    def spi_write(self, data):
+        data = bytearray(data)
+        if len(data) > self.max_transfer_size:
+            raise SimulatorError('SPI transfer of {0} bytes is larger than {1}'.format(
+                len(data), self.max_transfer_size))
+        self.transfers += 1
+        self.bytes_sent += len(data)
+        duration = len(data) * 8 / self.spi_speed_hz + SPI_TRANSFER_OVERHEAD
+        self.spi_time += duration
+        self._advance(duration)
+        if self._garbled():
+            self.garbled_transfers += 1
+            return
+        if self._pins.get(self.pins.dc, LOW) == LOW:
+            for command in data:
+                self._handle_command(command)
+        else:
+            self.data_bytes_sent += len(data)
+            self._handle_data(data)
+
+    def spi_read(self, count):
+        self.transfers += 1
+        duration = count * 8 / self.spi_speed_hz + SPI_TRANSFER_OVERHEAD
+        self.spi_time += duration
+        self._advance(duration)
+        if self._garbled():
+            self.garbled_transfers += 1
+            return bytearray(self._noise.getrandbits(8) for _ in range(count))
+        if self._command != epd.TEMPERATURE_SENSOR_COMMAND or self.temperature is None:
+            return bytearray(b'\xff' * count)  # nobody is driving the line
+        raw = int(round(self.temperature * 8)) & 0x7ff
+        return bytearray([raw >> 3, (raw & 0x7) << 5] + [0] * (count - 2))[:count]
+
+    def watch_rising(self, pin, callback):
+        if pin != self.pins.busy or not self.is_busy():
+            return
+        remaining = self._busy_until - self.now()
+        if self.realtime:
+            self._watch = threading.Timer(remaining, callback)
+            self._watch.daemon = True
+            self._watch.start()
+        else:
+            # Nothing else can happen while waiting, so skip straight to the edge
+            self._advance(remaining)
+            callback()
+
+    def unwatch(self, pin):
+        if self._watch is not None:
+            self._watch.cancel()
+            self._watch = None
+
+    def sleep(self, seconds):
+        self._advance(seconds)
+
+    # Controller model
+
+    def _reset(self):
+        # Registers go back to their defaults, the panel keeps showing what it showed
+        self._asleep = False
+        self._powered = False
+        self._command = None
+        self._data = bytearray()
+        self.luts = {}
+        self._pll_frame_rate = DEFAULT_FRAME_RATE
+
+    def _handle_command(self, command):
+        self._finish_command()
+        self.commands += 1
+        if self._asleep:
+            return
+        if self.is_busy() and command != epd.GET_STATUS:
+            self.commands_while_busy += 1
+        self._command = command
+        if command == epd.DISPLAY_REFRESH:
+            self._refresh('full', (0, 0, self.width, self.height))
+        elif command == epd.POWER_ON:
+            self._powered = True
+            self._set_busy(POWER_ON_TIME)
+
+    def _handle_data(self, data):
+        if self._asleep or self._command is None:
+            return
+        self._data += data
+        if self._command == epd.PARTIAL_DISPLAY_REFRESH and len(self._data) == _PARTIAL_WINDOW_SIZE:
+            # The refresh starts as soon as the window is known
+            self._refresh('partial', self._check_window(_parse_window(self._data)))
+        elif self._command == epd.DEEP_SLEEP and self._data[:1] == b'\xa5':
+            self._asleep = True
+
+    def _finish_command(self):
+        """ Apply the parameters of the previous command, now that all of them arrived """
+        command, data = self._command, self._data
+        self._command = None
+        self._data = bytearray()
+        if command == epd.DATA_START_TRANSMISSION_1:
+            self.old_ram[:len(data)] = data[:len(self.old_ram)]
+        elif command == epd.DATA_START_TRANSMISSION_2:
+            self.new_ram[:len(data)] = data[:len(self.new_ram)]
+        elif command in (epd.PARTIAL_DATA_START_TRANSMISSION_1, epd.PARTIAL_DATA_START_TRANSMISSION_2):
+            if len(data) < _PARTIAL_WINDOW_SIZE:
+                raise SimulatorError('Partial data sent without a window')
+            region = self._check_window(_parse_window(data))
+            x0, y0, x1, y1 = region
+            pixels = data[_PARTIAL_WINDOW_SIZE:]
+            if len(pixels) != (x1 - x0) // 8 * (y1 - y0):
+                raise SimulatorError('Got {0} bytes of partial data for region {1}'.format(
+                    len(pixels), region))
+            ram = self.old_ram if command == epd.PARTIAL_DATA_START_TRANSMISSION_1 else self.new_ram
+            paste_buffer(ram, self.width, region, pixels)
+        elif command in _LUT_COMMANDS:
+            self.luts[command] = bytes(data)
+            self.lut_uploads += 1
+        elif command == epd.PLL_CONTROL and data:
+            self._pll_frame_rate = PLL_FRAME_RATES.get(data[0], DEFAULT_FRAME_RATE)
+
+    def _check_window(self, region):
+        x0, y0, x1, y1 = region
+        if x0 % 8 or x1 % 8 or x1 > self.width or y1 > self.height or x0 >= x1 or y0 >= y1:
+            raise SimulatorError('Invalid partial refresh window {0}'.format(region))
+        return region
+
+    def _lut_name(self):
+        for name, tables in _KNOWN_LUTS:
+            if all(self.luts.get(command) == table for command, table in tables.items()):
+                return name
+        return 'custom'
+
+    def refresh_duration(self):
+        """ How long a refresh takes with the currently uploaded LUTs, in seconds """
+        frames = max([waveform_frames(self.luts.get(command, b''))
+                      for command in _LUT_COMMANDS[1:]])
+        return frames / (self.frame_rate or self._pll_frame_rate)
+
+    def _refresh(self, kind, region):
+        if not self._powered:
+            raise SimulatorError('Refresh before POWER_ON')
+        duration = self.refresh_duration()
+        self.refreshes.append(Refresh(kind, region, self._lut_name(), self.now(), duration))
+        if kind == 'full':
+            self.displayed[:] = self.new_ram
+        else:
+            paste_buffer(self.displayed, self.width, region,
+                         crop_buffer(self.new_ram, self.width, region))
+        self._set_busy(duration)
+
+    def _set_busy(self, seconds):
+        start = max(self.now(), self._busy_until)
+        self._busy_until = start + seconds
+        self.busy_time += seconds
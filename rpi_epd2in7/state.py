@@ -0,0 +1,134 @@
+""" state.py - remember what the display shows across restarts """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import math
+import mmap
+import os
+import struct
+import tempfile
+
+# E-paper keeps showing the last image without power, so after a restart the
+# panel still shows what the previous process left on it. Saving the shadow
+# buffer and the ghosting counters lets the next process carry on with
+# partial refreshes, instead of starting with a full flush.
+#
+# File layout (little endian):
+#   header: magic, version, panel width and height, ghosting tile columns and
+#           rows, last temperature and when it was read (NaN if unknown)
+#   the packed frame buffer the panel shows
+#   ghosting counts, then wear counts, one unsigned short per tile
+
+MAGIC = b'EPDS'
+VERSION = 1
+
+_HEADER = struct.Struct(str('<4sBxHHHHdd'))
+_MAX_COUNT = 0xffff
+
+
+def _float_or_nan(value):
+    return float('nan') if value is None else value
+
+
+def _nan_to_none(value):
+    return None if math.isnan(value) else value
+
+
+class StateFile(object):
+    """ A small file with what the display shows, and how worn down it is.
+
+    Written atomically after every update, so a restarted process never
+    reads a half written file. EPD does this for you when it's given a
+    `state_file` path. """
+
+    def __init__(self, path):
+        self.path = path
+        """ path of the state file """
+
+    def save(self, epd):
+        """ Save the shadow buffer, ghosting counters and temperature of `epd` """
+        ghosting = epd.ghosting
+        tiles = ghosting.columns * ghosting.rows
+        counts = [min(count, _MAX_COUNT) for count in ghosting.ghosting + ghosting.wear]
+        data = b''.join((
+            _HEADER.pack(MAGIC, VERSION, epd.panel_width, epd.panel_height,
+                         ghosting.columns, ghosting.rows,
+                         _float_or_nan(epd.temperature), _float_or_nan(epd._temperature_read_at)),
+            bytes(epd._shadow),
+            struct.pack(str('<{0}H').format(2 * tiles), *counts),
+        ))
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(self.path) + '.')
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            os.unlink(temp_path)
+            raise
+
+    def load(self, epd):
+        """ Restore the state saved for a display like `epd` into it.
+        Returns False, and leaves `epd` alone, if there's no usable state """
+        try:
+            with open(self.path, 'rb') as state_file:
+                data = mmap.mmap(state_file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            # Missing, unreadable or empty
+            return False
+        try:
+            return self._restore(data, epd)
+        finally:
+            data.close()
+
+    def _restore(self, data, epd):
+        ghosting = epd.ghosting
+        if len(data) < _HEADER.size:
+            return False
+        (magic, version, width, height, columns, rows,
+         temperature, temperature_read_at) = _HEADER.unpack_from(data)
+        if (magic != MAGIC or version != VERSION or
+                (width, height) != (epd.panel_width, epd.panel_height) or
+                (columns, rows) != (ghosting.columns, ghosting.rows)):
+            return False
+        frame_size = width * height // 8
+        tiles = columns * rows
+        if len(data) != _HEADER.size + frame_size + 4 * tiles:
+            return False
+        offset = _HEADER.size
+        shadow = bytearray(data[offset:offset + frame_size])
+        counts = struct.unpack_from(str('<{0}H').format(2 * tiles), data, offset + frame_size)
+        epd._shadow = shadow
+        ghosting.ghosting = list(counts[:tiles])
+        ghosting.wear = list(counts[tiles:])
+        if epd.temperature is None:
+            epd.temperature = _nan_to_none(temperature)
+            epd._temperature_read_at = _nan_to_none(temperature_read_at)
+        return True
+
+    def remove(self):
+        """ Delete the state file, for when the display was changed by something else """
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
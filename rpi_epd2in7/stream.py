@@ -0,0 +1,145 @@
+""" stream.py - show packed frames from pipes, files and generators """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import argparse
+import json
+import sys
+
+from .epd import EPD, ROTATIONS
+
+# Frames that are already packed (one bit per pixel, see EPD.display_buffer())
+# don't need Pillow at all: they're compared to the shadow buffer and sent
+# over SPI as they are. Frames are read into a single buffer that's reused
+# for every frame, so showing a stream doesn't allocate a frame per frame.
+
+
+def read_frames(stream, frame_size):
+    """ Read packed frames of `frame_size` bytes from the binary file object `stream`, until it ends.
+    Yields memoryviews of a single buffer that's reused for every frame,
+    so a frame is only valid until the next one is read.
+    Raises ValueError if the stream ends in the middle of a frame """
+    buf = bytearray(frame_size)
+    view = memoryview(buf)
+    readinto = getattr(stream, 'readinto', None)
+    while True:
+        filled = 0
+        # Pipes can return less than asked for
+        while filled < frame_size:
+            if readinto is not None:
+                count = readinto(view[filled:])
+            else:
+                chunk = stream.read(frame_size - filled)
+                count = len(chunk)
+                view[filled:filled + count] = chunk
+            if not count:
+                break
+            filled += count
+        if not filled:
+            return
+        if filled < frame_size:
+            raise ValueError('Stream ended after {0} of {1} bytes of a frame'.format(filled, frame_size))
+        yield view
+
+
+def feed(epd, frames, full=False):
+    """ Show every frame of the iterable `frames` on `epd` as soon as it arrives.
+    Frames are packed data of the whole display, or (box, data) pairs to update
+    only a box of it, see EPD.smart_update_buffer().
+    If `full` is True, every frame is shown with a full refresh.
+    Returns the number of frames shown """
+    update = epd.display_buffer if full else epd.smart_update_buffer
+    count = 0
+    for frame in frames:
+        if isinstance(frame, tuple):
+            box, data = frame
+            update(data, box)
+        else:
+            update(frame)
+        count += 1
+    return count
+
+
+def _parse_box(text):
+    try:
+        box = tuple(int(value) for value in text.split(','))
+    except ValueError:
+        box = ()
+    if len(box) != 4:
+        raise argparse.ArgumentTypeError('Expected x0,y0,x1,y1, got {0}'.format(text))
+    x0, y0, x1, y1 = box
+    if x0 % 8 or x1 % 8:
+        raise argparse.ArgumentTypeError('x0 and x1 must be multiples of 8, got {0}'.format(text))
+    if not (0 <= x0 < x1 and 0 <= y0 < y1):
+        raise argparse.ArgumentTypeError('Expected a non-empty box, got {0}'.format(text))
+    return box
+
+
+def main(argv=None):
+    """ Command line entry point, run with python -m rpi_epd2in7.stream --help """
+    parser = argparse.ArgumentParser(
+        description='Show packed 1 bit per pixel frames (like the tobytes() of mode "1" images) '
+                    'read from a file or stdin on the display, one after the other')
+    parser.add_argument('input', nargs='?', default='-', help='file to read frames from, - for stdin')
+    parser.add_argument('--rotation', type=int, choices=ROTATIONS, default=0,
+                        help='rotation of the frames, see EPD.rotation')
+    parser.add_argument('--box', type=_parse_box, metavar='X0,Y0,X1,Y1',
+                        help='frames only cover this part of the display')
+    parser.add_argument('--full', action='store_true', help='show every frame with a full refresh')
+    parser.add_argument('--state-file', help='remember what the display shows in this file')
+    parser.add_argument('--sleep', action='store_true', help='put the display to sleep at the end')
+    parser.add_argument('--simulate', action='store_true',
+                        help='use a simulated display, and print its stats at the end')
+    args = parser.parse_args(argv)
+    if args.box is not None and args.rotation in (90, 270) and (args.box[1] % 8 or args.box[3] % 8):
+        parser.error('with --rotation {0}, y0 and y1 of --box must be multiples of 8'.format(args.rotation))
+
+    backend = None
+    if args.simulate:
+        from .simulator import SimulatedBackend
+        backend = SimulatedBackend()
+    epd = EPD(backend=backend, rotation=args.rotation, state_file=args.state_file)
+    x0, y0, x1, y1 = args.box if args.box is not None else (0, 0, epd.width, epd.height)
+    if x1 > epd.width or y1 > epd.height:
+        parser.error('--box must fit in the {0}x{1} display'.format(epd.width, epd.height))
+    frame_size = (x1 - x0) // 8 * (y1 - y0)
+
+    if args.input == '-':
+        stream = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        stream = open(args.input, 'rb')
+    try:
+        frames = read_frames(stream, frame_size)
+        if args.box is not None:
+            frames = ((args.box, frame) for frame in frames)
+        feed(epd, frames, args.full)
+    finally:
+        if args.input != '-':
+            stream.close()
+    if args.sleep:
+        epd.sleep()
+    if args.simulate:
+        json.dump(backend.stats(), sys.stderr, indent=2, sort_keys=True)
+        sys.stderr.write('\n')
+
+
+if __name__ == '__main__':
+    main()
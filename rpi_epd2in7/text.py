@@ -0,0 +1,269 @@
+""" text.py - render text once, and show it again without drawing it again """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import collections
+import threading
+
+from PIL import Image
+from PIL import ImageDraw
+from PIL import ImageFont
+
+from .packing import pack_image, crop_buffer, paste_buffer, rotate_buffer
+from .regions import merge_regions, rotate_box
+
+# Strings are rendered black on white into packed bitmaps that start on a
+# byte boundary, so showing them is just copying bytes into the frame buffer.
+# Text is drawn at the same position draw.text() would draw it, so a string
+# has a different bitmap for each of the 8 possible offsets of its x coordinate
+# from a byte boundary; usually only one of them is used.
+# On a rotated display the bitmap is stored already rotated, and for 90 and
+# 270 degrees it's the y coordinate that has to line up with the panel's bytes.
+
+CACHE_SIZE = 256 * 1024
+""" Default memory cap for rendered strings, in bytes """
+
+FONT_CACHE_SIZE = 16
+""" Default number of fonts to keep loaded """
+
+# Rough per-entry overhead of a cached string, on top of its bitmap
+_ENTRY_OVERHEAD = 200
+
+Rendered = collections.namedtuple('Rendered', ['x', 'y', 'width', 'height', 'data', 'box'])
+""" A packed, black on white bitmap of a string.
+`x` and `y` are its offset from the position the text is drawn at, and
+`width` and `height` its size, before rotation. `data` is rotated the way
+the display shows it, and starts on a byte boundary of the panel.
+`box` is the (x0, y0, x1, y1) bounding box of the text in the bitmap, before
+rotation; only that part of the bitmap is drawn """
+
+
+class TextRenderer(object):
+    """ Draws text straight into the display's frame buffer, caching fonts
+    and rendered strings.
+
+    Text is drawn opaque: the whole bounding box of the string is replaced,
+    which is what you want for labels and clocks that change in place.
+
+    Usage:
+        renderer = TextRenderer()
+        font = renderer.font('/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf', 16)
+        renderer.update(epd, [((5, 200), '12:34', font)])
+    """
+
+    def __init__(self, cache_size=CACHE_SIZE, font_cache_size=FONT_CACHE_SIZE):
+        """ `cache_size` - memory cap for rendered strings in bytes
+        `font_cache_size` - number of fonts to keep loaded """
+        self.cache_size = cache_size
+        self.font_cache_size = font_cache_size
+        self.hits = 0
+        """ number of strings found in the cache """
+        self.misses = 0
+        """ number of strings that had to be rendered """
+        self._fonts = collections.OrderedDict()
+        self._cache = collections.OrderedDict()
+        self._cache_bytes = 0
+        self._lock = threading.Lock()
+
+    def font(self, path, size, index=0):
+        """ Load a TrueType font, or get it from the cache if it was already loaded """
+        key = (path, size, index)
+        with self._lock:
+            font = self._fonts.pop(key, None)
+            if font is None:
+                font = ImageFont.truetype(path, size, index)
+            self._fonts[key] = font
+            while len(self._fonts) > self.font_cache_size:
+                self._fonts.popitem(last=False)
+        return font
+
+    def render(self, text, font, shift=0, rotation=0, shift_y=0):
+        """ Get the Rendered bitmap of `text`, drawn at an x coordinate `shift` pixels (0-7)
+        past a byte boundary, rotated by `rotation` degrees like EPD.rotation.
+        For 90 and 270 degrees `shift_y` is the same for the y coordinate """
+        key = (font, text, shift, rotation, shift_y)
+        with self._lock:
+            rendered = self._cache.pop(key, None)
+            if rendered is not None:
+                self._cache[key] = rendered
+                self.hits += 1
+                return rendered
+        rendered = self._render(text, font, shift, rotation, shift_y)
+        with self._lock:
+            self.misses += 1
+            if key not in self._cache:
+                self._cache[key] = rendered
+                self._cache_bytes += len(rendered.data) + _ENTRY_OVERHEAD
+            while self._cache_bytes > self.cache_size and self._cache:
+                _, evicted = self._cache.popitem(last=False)
+                self._cache_bytes -= len(evicted.data) + _ENTRY_OVERHEAD
+        return rendered
+
+    def _render(self, text, font, shift, rotation, shift_y):
+        if font is None:
+            font = ImageFont.load_default()
+        draw = ImageDraw.Draw(Image.new('1', (1, 1)))
+        if hasattr(draw, 'textbbox'):
+            x0, y0, x1, y1 = draw.textbbox((0, 0), text, font=font)
+        else:
+            # Pillow < 8
+            x0, y0 = 0, 0
+            x1, y1 = draw.textsize(text, font=font)
+        # Relative to the byte boundary before the drawing position,
+        # the bitmap spans the text's bounding box rounded out to whole bytes
+        left = (shift + x0) // 8 * 8
+        right = (shift + x1 + 7) // 8 * 8
+        width = max(right - left, 8)
+        if rotation in (90, 270):
+            top = (shift_y + y0) // 8 * 8
+            height = max((shift_y + y1 + 7) // 8 * 8 - top, 8)
+        else:
+            top = shift_y + y0
+            height = max(y1 - y0, 1)
+        image = Image.new('1', (width, height), 255)
+        ImageDraw.Draw(image).text((shift - left, shift_y - top), text, font=font, fill=0)
+        data = rotate_buffer(pack_image(image), width, height, rotation)
+        box = (shift - left + x0, shift_y - top + y0, shift - left + x1, shift_y - top + y1)
+        return Rendered(left - shift, top - shift_y, width, height, bytes(data), box)
+
+    def cached_bytes(self):
+        """ Memory used by rendered strings, roughly, in bytes """
+        return self._cache_bytes
+
+    def clear_cache(self):
+        """ Forget all rendered strings and loaded fonts """
+        with self._lock:
+            self._cache.clear()
+            self._fonts.clear()
+            self._cache_bytes = 0
+
+    def _place(self, xy, text, font, width, height, rotation=0):
+        """ Get the packed bitmap of `text` drawn at `xy` on a `width`x`height`
+        screen rotated by `rotation`, the (x0, y0, x1, y1) panel box it goes to,
+        and the panel box of the text itself within it """
+        x, y = int(xy[0]), int(xy[1])
+        # Python's modulo is never negative, even for text starting off-screen
+        shift_y = y % 8 if rotation in (90, 270) else 0
+        rendered = self.render(text, font, x % 8, rotation, shift_y)
+        x0 = x + rendered.x
+        y0 = y + rendered.y
+        box = (x0, y0, x0 + rendered.width, y0 + rendered.height)
+        bx0, by0, bx1, by1 = rendered.box
+        text_box = (x0 + bx0, y0 + by0, x0 + bx1, y0 + by1)
+        return (rendered.data, rotate_box(box, width, height, rotation),
+                rotate_box(text_box, width, height, rotation))
+
+    def blit(self, frame, width, height, xy, text, font=None, rotation=0):
+        """ Draw `text` at `xy` into the packed frame buffer `frame`, which is `width`x`height`.
+        If `rotation` is set, `xy` is in the frame rotated back by it, like EPD.rotation.
+        Returns the (x0, y0, x1, y1) region of `frame` that was drawn to, or None if it's off screen """
+        if rotation in (90, 270):
+            data, box, text_box = self._place(xy, text, font, height, width, rotation)
+        else:
+            data, box, text_box = self._place(xy, text, font, width, height, rotation)
+        return _paste_clipped(frame, width, height, (0, 0), data, box, text_box)
+
+    def update(self, epd, items):
+        """ Draw text on the display and refresh the areas it was drawn to.
+        `items` is a sequence of (xy, text, font) tuples, drawn in order.
+        Refresh modes are picked like EPD.smart_update() does """
+        width, height = epd.panel_width, epd.panel_height
+        placed = [self._place(xy, text, font, epd.width, epd.height, epd.rotation)
+                  for xy, text, font in items]
+        if epd._needs_full_refresh():
+            if epd._shadow is not None:
+                frame = bytearray(epd._shadow)
+            else:
+                frame = bytearray(b'\xff' * (width * height // 8))
+            for data, box, text_box in placed:
+                _paste_clipped(frame, width, height, (0, 0), data, box, text_box)
+            epd._display_frame_buffer(frame)
+            return
+        regions = []
+        for data, box, text_box in placed:
+            region = _clip(box, width, height)
+            if region is not None:
+                regions.append(region)
+        if not regions:
+            return
+        refreshed = False
+        for region in merge_regions(regions, epd._region_overhead(epd.fast_refresh), epd.max_partial_regions):
+            x0, y0, x1, y1 = region
+            old_fb = crop_buffer(epd._shadow, width, region)
+            new_fb = bytearray(old_fb)
+            for data, box, text_box in placed:
+                _paste_clipped(new_fb, x1 - x0, y1 - y0, (x0, y0), data, box, text_box)
+            if new_fb == old_fb:
+                continue
+            epd._smart_update_region(region, old_fb, new_fb)
+            paste_buffer(epd._shadow, width, region, new_fb)
+            refreshed = True
+        if refreshed:
+            epd._save_state()
+
+
+def _clip(box, width, height):
+    x0, y0, x1, y1 = box
+    x0, y0 = max(x0, 0), max(y0, 0)
+    x1, y1 = min(x1, width), min(y1, height)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (x0, y0, x1, y1)
+
+
+def _paste_clipped(frame, width, height, origin, data, box, text_box=None):
+    """ Paste the packed bitmap `data` at `box` (in screen coordinates) into `frame`, a
+    `width`x`height` buffer whose top left corner is at `origin` on the screen.
+    If `text_box` is given, only the pixels inside of it are pasted, and the rest
+    of `frame` is left as it was. Returns the part of `box` that was pasted, in screen coordinates """
+    ox, oy = origin
+    visible = _clip((box[0] - ox, box[1] - oy, box[2] - ox, box[3] - oy), width, height)
+    if visible is None:
+        return None
+    vx0, vy0, vx1, vy1 = visible
+    # The same area, relative to the bitmap
+    bx0 = vx0 - (box[0] - ox)
+    by0 = vy0 - (box[1] - oy)
+    if visible != (box[0] - ox, box[1] - oy, box[2] - ox, box[3] - oy):
+        data = crop_buffer(data, box[2] - box[0], (bx0, by0, bx0 + vx1 - vx0, by0 + vy1 - vy0))
+    if text_box is not None:
+        # The text box, relative to the visible area
+        inner = (max(text_box[0] - ox - vx0, 0), max(text_box[1] - oy - vy0, 0),
+                 min(text_box[2] - ox - vx0, vx1 - vx0), min(text_box[3] - oy - vy0, vy1 - vy0))
+        if inner != (0, 0, vx1 - vx0, vy1 - vy0):
+            data = _composite(crop_buffer(frame, width, visible), data, vx1 - vx0, vy1 - vy0, inner)
+    paste_buffer(frame, width, visible, data)
+    return (vx0 + ox, vy0 + oy, vx1 + ox, vy1 + oy)
+
+
+def _composite(old, new, width, height, inner):
+    """ Combine two packed `width`x`height` buffers, taking the pixels inside
+    the (x0, y0, x1, y1) box `inner` from `new`, and the rest from `old` """
+    x0, y0, x1, y1 = inner
+    stride = width // 8
+    if x0 >= x1 or y0 >= y1:
+        return bytes(old)
+    row = (((1 << (x1 - x0)) - 1) << (width - x1)).to_bytes(stride, 'big')
+    blank = bytes(bytearray(stride))
+    mask = int.from_bytes(blank * y0 + row * (y1 - y0) + blank * (height - y1), 'big')
+    result = ((int.from_bytes(bytes(old), 'big') & ~mask) |
+              (int.from_bytes(bytes(new), 'big') & mask))
+    return result.to_bytes(stride * height, 'big')
@@ -0,0 +1,68 @@
+""" conftest.py - fixtures for testing on the simulated panel """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.simulator import SimulatedBackend
+
+
+@pytest.fixture
+def panel():
+    """ A simulated panel with a virtual clock """
+    return SimulatedBackend()
+
+
+@pytest.fixture
+def epd(panel):
+    """ An initialized EPD on the simulated panel """
+    display = EPD(backend=panel)
+    display.init()
+    return display
+
+
+@pytest.fixture
+def random_image():
+    """ A function making `width`x`height` images of random black rectangles,
+    the same ones on every test run """
+    rng = random.Random(0)
+
+    def make(width, height, count=20):
+        image = Image.new('1', (width, height), 255)
+        draw = ImageDraw.Draw(image)
+        for _ in range(count):
+            x, y = rng.randrange(width), rng.randrange(height)
+            draw.rectangle((x, y, x + rng.randrange(30), y + rng.randrange(30)), fill=0)
+        return image
+    return make
+
+
+@pytest.fixture
+def shown():
+    """ A function getting what a simulated panel shows, in the
+    orientation of the images given to an EPD """
+    def get(epd, panel):
+        return panel.image().rotate(-epd.rotation, expand=True)
+    return get
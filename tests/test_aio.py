@@ -0,0 +1,49 @@
+""" test_aio.py - AsyncEPD on the simulated panel """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+import asyncio
+import time
+
+from PIL import Image
+
+from rpi_epd2in7.aio import AsyncEPD
+from rpi_epd2in7.simulator import SimulatedBackend
+
+
+def test_operations_keep_their_order():
+    async def run():
+        display = AsyncEPD(backend=SimulatedBackend())
+        older = Image.new('1', (176, 264), 0)
+        newer = Image.new('1', (176, 264), 255)
+        get_frame_buffer = display.epd._get_frame_buffer
+
+        def slow_for_older(image):
+            if image is older:
+                time.sleep(0.2)
+            return get_frame_buffer(image)
+        display.epd._get_frame_buffer = slow_for_older
+        try:
+            await display.display_frame(newer)
+            await asyncio.gather(display.smart_update(older), display.smart_update(newer))
+            return bytes(display.epd.backend.displayed), bytes(get_frame_buffer(newer))
+        finally:
+            display.close()
+    shown, expected = asyncio.run(run())
+    assert shown == expected
@@ -0,0 +1,101 @@
+""" test_epd.py - EPD updates on the simulated panel """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.simulator import SimulatedBackend
+
+ROTATIONS = (0, 90, 180, 270)
+
+
+@pytest.mark.parametrize('rotation', ROTATIONS)
+@pytest.mark.parametrize('fast_refresh', (False, True))
+def test_smart_update(rotation, fast_refresh, random_image, shown):
+    panel = SimulatedBackend()
+    epd = EPD(backend=panel, rotation=rotation, fast_refresh=fast_refresh, partial_refresh_limit=None)
+    epd.init()
+    for _ in range(6):
+        image = random_image(epd.width, epd.height)
+        epd.smart_update(image)
+        assert shown(epd, panel).tobytes() == image.tobytes()
+        assert bytes(epd._shadow) == bytes(panel.displayed)
+    # The first update is a full refresh, the rest are partial
+    assert panel.stats()['full_refreshes'] == 1
+
+
+@pytest.mark.parametrize('rotation', ROTATIONS)
+def test_display_partial_frame(rotation, random_image, shown):
+    panel = SimulatedBackend()
+    epd = EPD(backend=panel, rotation=rotation)
+    epd.display_frame(Image.new('1', (epd.width, epd.height), 255))
+    image = random_image(epd.width, epd.height)
+    box = (13, 21, 13 + 50, 21 + 30)
+    epd.display_partial_frame(image, box[0], box[1], box[3] - box[1], box[2] - box[0])
+    assert shown(epd, panel).crop(box).tobytes() == image.crop(box).tobytes()
+
+
+@pytest.mark.parametrize('rotation', ROTATIONS)
+def test_smart_update_buffer_box(rotation, random_image, shown):
+    panel = SimulatedBackend()
+    epd = EPD(backend=panel, rotation=rotation)
+    image = random_image(epd.width, epd.height)
+    epd.smart_update(image)
+    for i in range(3):
+        box = (8 * i, 8 * i, 8 * i + 32, 8 * i + 16)
+        patch = random_image(32, 16)
+        image.paste(patch, box[:2])
+        epd.smart_update_buffer(patch.tobytes(), box)
+        assert shown(epd, panel).tobytes() == image.tobytes()
+
+
+def test_smart_update_buffer_rejects_unaligned_box(epd):
+    with pytest.raises(ValueError):
+        epd.smart_update_buffer(bytes(bytearray(64)), (3, 0, 35, 16))
+
+
+def test_smart_update_unchanged_frame(epd, panel, random_image):
+    image = random_image(epd.width, epd.height)
+    epd.smart_update(image)
+    panel.reset_stats()
+    epd.smart_update(image)
+    assert panel.refreshes == []
+
+
+def test_fast_refresh_only_for_darkening(epd, panel):
+    image = Image.new('1', (epd.width, epd.height), 255)
+    epd.smart_update(image)
+    draw = ImageDraw.Draw(image)
+    draw.rectangle((40, 40, 60, 60), fill=0)
+    panel.reset_stats()
+    epd.smart_update(image)
+    assert [refresh.lut for refresh in panel.refreshes] == ['quick']
+    draw.rectangle((40, 40, 60, 60), fill=255)
+    panel.reset_stats()
+    epd.smart_update(image)
+    assert [refresh.lut for refresh in panel.refreshes] == ['normal']
+
+
+def test_invalid_rotation():
+    with pytest.raises(ValueError):
+        EPD(backend=SimulatedBackend(), rotation=45)
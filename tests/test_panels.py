@@ -0,0 +1,55 @@
+""" test_panels.py - PanelManager on simulated panels """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import pytest
+from PIL import Image
+
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.panels import PanelManager
+from rpi_epd2in7.simulator import SimulatedBackend
+
+
+def test_updates_every_panel(random_image):
+    panels = [SimulatedBackend() for _ in range(3)]
+    manager = PanelManager([EPD(backend=panel) for panel in panels])
+    manager.init()
+    images = [random_image(176, 264) for _ in panels]
+    manager.smart_update(images)
+    assert [panel.image().tobytes() for panel in panels] == [image.tobytes() for image in images]
+    # Panels without an image are left alone
+    manager.smart_update([None, random_image(176, 264), None])
+    assert panels[0].image().tobytes() == images[0].tobytes()
+    # All simulated panels share a bus
+    assert len(set(id(epd.bus_lock) for epd in manager.panels)) == 1
+
+
+def test_errors(random_image):
+    panels = [SimulatedBackend() for _ in range(2)]
+    manager = PanelManager([EPD(backend=panel) for panel in panels])
+    image = random_image(176, 264)
+    with pytest.raises(ValueError):
+        manager.display_frame([Image.new('1', (10, 10)), image])
+    assert [index for index, error in manager.errors] == [0]
+    # The other panel was still updated
+    assert panels[1].image().tobytes() == image.tobytes()
+    with pytest.raises(ValueError):
+        manager.smart_update([image])
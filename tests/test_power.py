@@ -0,0 +1,100 @@
+""" test_power.py - PowerManager on the simulated panel """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import time
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.power import PowerManager
+from rpi_epd2in7.simulator import SimulatedBackend
+
+
+def wait_for(predicate, timeout=10):
+    deadline = time.time() + timeout
+    while not predicate():
+        assert time.time() < deadline, 'timed out'
+        time.sleep(0.01)
+
+
+@pytest.fixture
+def manager(panel):
+    manager = PowerManager(EPD(backend=panel), clean_after=0.05, sleep_after=0.2)
+    manager.start()
+    yield manager
+    manager.stop()
+
+
+def test_cleans_up_then_sleeps(manager, panel):
+    image = Image.new('1', (manager.epd.width, manager.epd.height), 255)
+    manager.display_frame(image)
+    ImageDraw.Draw(image).rectangle((40, 40, 60, 60), fill=0)
+    manager.smart_update(image)
+    assert panel.refreshes[-1].lut == 'quick'
+    wait_for(lambda: manager.stats()['cleanups'] == 1)
+    assert panel.refreshes[-1].lut == 'normal'
+    wait_for(manager.sleeping)
+    assert manager.stats()['sleeps'] == 1
+    # Updating wakes it up again
+    ImageDraw.Draw(image).rectangle((80, 80, 90, 90), fill=0)
+    manager.smart_update(image)
+    assert not manager.sleeping()
+    assert panel.image().tobytes() == image.tobytes()
+    assert manager.stats()['wakeups'] == 2
+
+
+def test_activity_keeps_it_awake(manager):
+    manager.display_frame(Image.new('1', (manager.epd.width, manager.epd.height), 255))
+    for _ in range(5):
+        with manager.activity():
+            pass
+        time.sleep(0.05)
+        assert not manager.sleeping()
+
+
+def test_stop_and_sleep(panel):
+    manager = PowerManager(EPD(backend=panel), clean_after=None, sleep_after=None)
+    manager.start()
+    manager.display_frame(Image.new('1', (manager.epd.width, manager.epd.height), 255))
+    manager.stop(sleep=True)
+    assert manager._thread is None
+    assert manager.sleeping() and panel._asleep
+    assert manager.stats()['sleeps'] == 1
+
+
+def test_errors_are_raised_by_the_next_update(manager):
+    def broken():
+        raise RuntimeError('broken')
+    manager.epd.sleep = broken
+    manager.display_frame(Image.new('1', (manager.epd.width, manager.epd.height), 255))
+    wait_for(lambda: manager._error is not None)
+    with pytest.raises(RuntimeError):
+        manager.smart_update(Image.new('1', (manager.epd.width, manager.epd.height), 0))
+    manager.stop()
+    assert manager._thread is None
+
+
+def test_stop_without_start():
+    manager = PowerManager(EPD(backend=SimulatedBackend()))
+    manager.stop(sleep=True)
+    assert manager.stats()['sleeps'] == 0
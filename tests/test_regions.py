@@ -0,0 +1,163 @@
+""" test_regions.py - finding and planning the regions to refresh """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import random
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rpi_epd2in7.ghosting import GhostingBudget
+from rpi_epd2in7.regions import (find_dirty_regions, merge_regions, refresh_overhead,
+                                 REGION_OVERHEAD, MAX_REGIONS)
+
+WIDTH = 176
+HEIGHT = 264
+STRIDE = WIDTH // 8
+
+
+def mark(buf, x0, y0, x1, y1):
+    """ Set the bytes of `buf` covering the box, x0 and x1 in bytes """
+    for y in range(y0, y1):
+        buf[y * STRIDE + x0:y * STRIDE + x1] = b'\xff' * (x1 - x0)
+
+
+def covers(regions, buf):
+    """ Check every set byte of `buf` is in one of `regions` """
+    for offset, value in enumerate(buf):
+        if value:
+            x, y = offset % STRIDE * 8, offset // STRIDE
+            if not any(x0 <= x < x1 and y0 <= y < y1 for x0, y0, x1, y1 in regions):
+                return False
+    return True
+
+
+def test_no_changes():
+    assert find_dirty_regions(bytearray(WIDTH * HEIGHT // 8), WIDTH, HEIGHT) == []
+
+
+def test_far_apart_changes_are_separate():
+    diff = bytearray(WIDTH * HEIGHT // 8)
+    mark(diff, 0, 0, 2, 10)
+    mark(diff, 19, 250, 22, 260)
+    assert find_dirty_regions(diff, WIDTH, HEIGHT) == [(0, 0, 16, 10), (152, 250, 176, 260)]
+
+
+def test_close_changes_are_merged():
+    diff = bytearray(WIDTH * HEIGHT // 8)
+    mark(diff, 0, 0, 2, 10)
+    mark(diff, 3, 2, 4, 8)
+    assert find_dirty_regions(diff, WIDTH, HEIGHT) == [(0, 0, 32, 10)]
+
+
+def test_max_regions():
+    regions = [(0, y, 8, y + 1) for y in range(0, 260, 20)]
+    assert len(merge_regions(regions, 0, max_regions=3)) == 3
+    assert len(merge_regions(regions, 0, max_regions=0)) == 1
+
+
+def test_refresh_overhead_is_capped():
+    assert refresh_overhead(5.0, 2000000) == REGION_OVERHEAD
+    assert refresh_overhead(0.1, 8000) == 100
+
+
+def test_plan_regions_separates_fast_and_normal():
+    ghosting = GhostingBudget(WIDTH, HEIGHT)
+    diff = bytearray(WIDTH * HEIGHT // 8)
+    whitened = bytearray(len(diff))
+    mark(diff, 0, 0, 2, 10)
+    mark(whitened, 0, 0, 2, 10)
+    mark(diff, 19, 250, 22, 260)
+    regions = ghosting.plan_regions(diff, whitened, REGION_OVERHEAD, MAX_REGIONS, 35000)
+    assert regions == [(0, 0, 16, 10), (152, 250, 176, 260)]
+
+
+def test_plan_regions_absorbs_neighbouring_fast_regions():
+    ghosting = GhostingBudget(WIDTH, HEIGHT)
+    diff = bytearray(WIDTH * HEIGHT // 8)
+    whitened = bytearray(len(diff))
+    mark(diff, 0, 0, 2, 10)
+    mark(whitened, 0, 0, 2, 10)
+    # In the tile row below
+    mark(diff, 0, 20, 2, 24)
+    assert ghosting.plan_regions(diff, whitened, 0, MAX_REGIONS) == [(0, 0, 16, 24)]
+
+
+@pytest.mark.parametrize('max_regions', (1, 2, 4))
+def test_plan_regions_respects_max_regions(max_regions):
+    rng = random.Random(max_regions)
+    for _ in range(50):
+        ghosting = GhostingBudget(WIDTH, HEIGHT)
+        diff = bytearray(WIDTH * HEIGHT // 8)
+        whitened = bytearray(len(diff))
+        for _ in range(rng.randint(1, 12)):
+            offset = rng.randrange(len(diff))
+            diff[offset] = 0xff
+            if rng.random() < 0.4:
+                whitened[offset] = 0x0f
+        regions = ghosting.plan_regions(diff, whitened, REGION_OVERHEAD, max_regions)
+        assert 1 <= len(regions) <= max_regions
+        assert covers(regions, diff)
+
+
+def corners(epd, panel, whiten_first):
+    """ Change the top left and bottom right corners of the display,
+    whitening the top left one if `whiten_first` is set """
+    image = Image.new('1', (epd.width, epd.height), 255)
+    draw = ImageDraw.Draw(image)
+    if whiten_first:
+        draw.rectangle((0, 0, 20, 10), fill=0)
+    epd.smart_update(image)
+    draw.rectangle((0, 0, 20, 10), fill=255 if whiten_first else 0)
+    draw.rectangle((150, 250, 170, 260), fill=0)
+    panel.reset_stats()
+    epd.smart_update(image)
+    return image
+
+
+def test_far_apart_updates(epd, panel):
+    image = corners(epd, panel, whiten_first=False)
+    assert [refresh.region for refresh in panel.refreshes] == [(0, 0, 24, 11), (144, 250, 176, 261)]
+    assert panel.image().tobytes() == image.tobytes()
+    # The tiles in between weren't touched
+    ghosting = epd.ghosting
+    middle = (ghosting.rows // 2) * ghosting.columns + ghosting.columns // 2
+    assert ghosting.wear[middle] == 0
+
+
+def test_far_apart_whitening_doesnt_slow_down_the_rest(epd, panel):
+    image = corners(epd, panel, whiten_first=True)
+    assert [(refresh.lut, refresh.region) for refresh in panel.refreshes] == [
+        ('normal', (0, 0, 24, 11)), ('quick', (144, 250, 176, 261))]
+    assert panel.image().tobytes() == image.tobytes()
+
+
+def test_far_apart_updates_without_fast_refresh(epd, panel):
+    epd.fast_refresh = False
+    corners(epd, panel, whiten_first=True)
+    assert [(refresh.lut, refresh.region) for refresh in panel.refreshes] == [
+        ('normal', (0, 0, 24, 11)), ('normal', (144, 250, 176, 261))]
+
+
+def test_max_partial_regions(epd, panel):
+    epd.max_partial_regions = 1
+    corners(epd, panel, whiten_first=True)
+    assert [(refresh.lut, refresh.region) for refresh in panel.refreshes] == [('normal', (0, 0, 176, 261))]
@@ -0,0 +1,103 @@
+""" test_scheduler.py - UpdateScheduler on the simulated panel """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import pytest
+from PIL import Image
+
+from rpi_epd2in7.scheduler import UpdateScheduler
+
+
+@pytest.fixture(params=(False, True), ids=('direct', 'pipelined'))
+def scheduler(request, epd):
+    scheduler = UpdateScheduler(epd, pipelined=request.param)
+    scheduler.start()
+    yield scheduler
+    scheduler.stop(flush=False)
+
+
+def test_displays_the_last_frame(scheduler, epd, panel, random_image):
+    images = [random_image(epd.width, epd.height) for _ in range(5)]
+    for image in images:
+        scheduler.submit(image)
+    assert scheduler.flush(timeout=10)
+    assert panel.image().tobytes() == images[-1].tobytes()
+    stats = scheduler.stats()
+    assert stats['submitted'] == 5
+    assert stats['displayed'] + stats['coalesced'] == 5
+    assert stats['pending'] == 0
+
+
+def test_stop_flushes(scheduler, epd, panel, random_image):
+    image = random_image(epd.width, epd.height)
+    scheduler.submit(image)
+    scheduler.stop()
+    assert panel.image().tobytes() == image.tobytes()
+    assert scheduler._thread is None and scheduler._prepare_thread is None
+
+
+def test_error_is_raised_by_flush(scheduler, epd, random_image):
+    wrong_size = Image.new('1', (10, 10), 255)
+    if scheduler.pipelined:
+        scheduler.submit(wrong_size)
+        with pytest.raises(ValueError):
+            scheduler.flush(timeout=10)
+    else:
+        # Packed right away
+        with pytest.raises(ValueError):
+            scheduler.submit(wrong_size)
+    # The scheduler carries on
+    scheduler.submit(random_image(epd.width, epd.height))
+    assert scheduler.flush(timeout=10)
+
+
+def test_stop_stops_threads_after_an_error(epd):
+    scheduler = UpdateScheduler(epd, pipelined=True)
+    scheduler.start()
+    scheduler.submit(Image.new('1', (10, 10), 255))
+    with pytest.raises(ValueError):
+        scheduler.stop()
+    assert not scheduler._running
+    assert scheduler._thread is None and scheduler._prepare_thread is None
+
+
+def test_flush_timeout(epd, random_image):
+    scheduler = UpdateScheduler(epd)
+    # Not started, so nothing gets displayed
+    scheduler.submit(random_image(epd.width, epd.height))
+    assert not scheduler.flush(timeout=0.05)
+
+
+def test_cleans_up_when_idle(epd, panel):
+    scheduler = UpdateScheduler(epd, clean_after=0.05)
+    scheduler.start()
+    image = Image.new('1', (epd.width, epd.height), 255)
+    scheduler.submit(image)
+    scheduler.flush(timeout=10)
+    image.paste(0, (40, 40, 60, 60))
+    scheduler.submit(image)
+    scheduler.flush(timeout=10)
+    assert panel.refreshes[-1].lut == 'quick'
+    with scheduler._condition:
+        scheduler._condition.wait_for(lambda: scheduler.cleanups, timeout=10)
+    scheduler.stop()
+    assert scheduler.cleanups == 1
+    assert panel.refreshes[-1].lut == 'normal'
@@ -0,0 +1,51 @@
+""" test_stream.py - streaming packed frames """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import argparse
+import io
+
+import pytest
+
+from rpi_epd2in7 import stream
+
+
+def test_read_frames():
+    frames = [bytes(frame) for frame in stream.read_frames(io.BytesIO(b'abcdef'), 3)]
+    assert frames == [b'abc', b'def']
+    with pytest.raises(ValueError):
+        list(stream.read_frames(io.BytesIO(b'abcd'), 3))
+
+
+def test_feed(epd, panel, random_image):
+    images = [random_image(epd.width, epd.height) for _ in range(3)]
+    assert stream.feed(epd, (image.tobytes() for image in images)) == 3
+    assert panel.image().tobytes() == images[-1].tobytes()
+
+
+@pytest.mark.parametrize('text', ('3,8,72,18', '8,8,8,18', '1,2,3', 'a,b,c,d'))
+def test_parse_box_errors(text):
+    with pytest.raises(argparse.ArgumentTypeError):
+        stream._parse_box(text)
+
+
+def test_parse_box():
+    assert stream._parse_box('8,3,72,18') == (8, 3, 72, 18)
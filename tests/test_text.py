@@ -0,0 +1,60 @@
+""" test_text.py - TextRenderer drawing and updates """
+# Copyright (C) 2018 Elad Alfassa <elad@fedoraproject.org>
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+from __future__ import unicode_literals, division, absolute_import
+
+import pytest
+from PIL import Image, ImageDraw
+
+from rpi_epd2in7.epd import EPD
+from rpi_epd2in7.simulator import SimulatedBackend
+from rpi_epd2in7.text import TextRenderer
+
+
+@pytest.mark.parametrize('rotation', (0, 90, 180, 270))
+def test_text_only_replaces_its_box(rotation, shown):
+    panel = SimulatedBackend()
+    epd = EPD(backend=panel, rotation=rotation)
+    image = Image.new('1', (epd.width, epd.height), 255)
+    # A bar right next to the text, in the same byte
+    ImageDraw.Draw(image).rectangle((8, 0, 11, 40), fill=0)
+    epd.display_frame(image)
+    TextRenderer().update(epd, [((13, 5), 'Hi', None)])
+    result = shown(epd, panel)
+    assert all(result.getpixel((x, y)) == 0 for x in range(8, 12) for y in range(41))
+    # The text was drawn
+    assert result.crop((13, 0, 40, 25)).getextrema()[0] == 0
+
+
+@pytest.mark.parametrize('rotation', (0, 90, 180, 270))
+def test_blit(rotation):
+    width, height = (176, 264) if rotation in (0, 180) else (264, 176)
+    frame = bytearray(b'\xff' * (176 * 264 // 8))
+    renderer = TextRenderer()
+    renderer.blit(frame, 176, 264, (30, 21), 'blit', rotation=rotation)
+    expected = Image.new('1', (width, height), 255)
+    ImageDraw.Draw(expected).text((30, 21), 'blit', fill=0)
+    assert bytes(frame) == expected.rotate(rotation, expand=True).tobytes()
+
+
+def test_off_screen():
+    frame = bytearray(b'\xff' * (176 * 264 // 8))
+    assert TextRenderer().blit(frame, 176, 264, (500, 500), 'gone') is None
+    assert frame == b'\xff' * len(frame)